@@ -0,0 +1,266 @@
+#######################################################################################################################
+#   Libraries, Modules & API                                                                                          #
+#######################################################################################################################
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+
+#######################################################################################################################
+#   Global Variables                                                                                                  #
+#######################################################################################################################
+
+# Folder of the benchmark and of the scripts to measure.
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCHMARK_DIR)
+
+
+#######################################################################################################################
+#   Functions                                                                                                         #
+#######################################################################################################################
+
+def free_port():
+    """ The function finds a free TCP port on the local host
+    :return: int
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, path, method='GET'):
+    """ The function sends a request to the mock
+    :param port: int
+    :param path: str
+    :param method: str
+    :return: the parsed JSON received as answer, None if there is no answer
+    """
+    with urllib.request.urlopen(urllib.request.Request('http://127.0.0.1:%d%s' % (port, path), method=method)) as resp:
+        body = resp.read()
+    return json.loads(body) if len(body) != 0 else None
+
+
+def wait_mock(port):
+    """ The function waits until the mock answers
+    :param port: int
+    :return: None
+    """
+    for i in range(100):
+        try:
+            request(port, '/ping')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('The mock did not start on port %d' % port)
+
+
+def process_tree(pid):
+    """ The function lists a process and all its descendants, reading /proc
+    :param pid: int
+    :return: list of int
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/' + entry + '/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The name of the process is between parentheses and can contain spaces.
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def resources(pid):
+    """ The function measures the memory and the threads of a process and of its descendants
+    :param pid: int
+    :return: tuple, the resident memory in megabytes and the number of threads
+    """
+    memory = 0
+    threads = 0
+
+    for process in process_tree(pid):
+        try:
+            with open('/proc/%d/status' % process) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        memory += int(line.split()[1]) / 1024
+                    elif line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+        except OSError:
+            pass
+
+    return memory, threads
+
+
+def run_case(args, size, processes, work_dir):
+    """ The function measures the script downloading a group of size devices, or a device with size measurements
+    :param args: parsed args
+    :param size: int
+    :param processes: int, the number of processes of the script
+    :param work_dir: str, the folder of the files of the script
+    :return: dict, the results
+    """
+    name = 'bench%d_%d' % (size, processes)
+    port = free_port()
+    devices = size if args.script == 'group' else 1
+    measurements = args.measurements if args.script == 'group' else size
+
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, 'mock_relayr.py'), '--port', str(port),
+                             '--devices', str(devices), '--measurements', str(measurements), '--rate', str(args.rate),
+                             '--latency', str(args.latency), '--history', str(args.history)])
+    try:
+        wait_mock(port)
+
+        start = (datetime.datetime.utcnow() - datetime.timedelta(seconds=args.history)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        command = [sys.executable, '-u']
+        if args.script == 'group':
+            command += [os.path.join(SCRIPTS_DIR, 'groups-raw-data-downloader.py'), '--group', 'bench-group']
+        else:
+            command += [os.path.join(SCRIPTS_DIR, 'raw-data-downloader.py'), '--device', 'dev-0']
+        command += ['--db', name, '--user', 'bench', '--password', 'bench', '--org', 'bench',
+                    '--cloud_url', 'http://127.0.0.1:%d' % port, '--login_url', 'http://127.0.0.1:%d' % port,
+                    '--influxdb_address', '127.0.0.1', '--influxdb_port', str(port), '--start', start,
+                    '--engine', args.engine, '--processes', str(processes)] + args.extra
+
+        with open(os.path.join(work_dir, name + '.log'), 'w') as log:
+            script = subprocess.Popen(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+
+        try:
+            memory = 0
+            threads = 0
+            began = time.time()
+            first = None
+
+            while time.time() - began < args.duration:
+                time.sleep(1)
+                if script.poll() is not None:
+                    raise RuntimeError('The script ended with code %d, see %s' % (
+                        script.returncode, os.path.join(work_dir, name + '.log')))
+
+                sample = resources(script.pid)
+                memory = max(memory, sample[0])
+                threads = max(threads, sample[1])
+
+                # The measure starts after the warm up, when the history is downloaded.
+                if first is None and time.time() - began >= args.warmup:
+                    request(port, '/stats/reset', 'POST')
+                    first = (time.time(), request(port, '/stats'))
+
+            last = (time.time(), request(port, '/stats'))
+        finally:
+            script.terminate()
+            try:
+                script.wait(10)
+            except subprocess.TimeoutExpired:
+                script.kill()
+                script.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    writes = last[1].get('writes', 0) - first[1].get('writes', 0)
+    return {'devices': devices,
+            'streams': devices * measurements,
+            'processes': processes,
+            'readings/s': (last[1].get('points', 0) - first[1].get('points', 0)) / (last[0] - first[0]),
+            'expected/s': devices * measurements * args.rate,
+            'lag mean s': (last[1].get('lag_sum', 0) - first[1].get('lag_sum', 0)) / writes if writes else None,
+            'lag max s': last[1].get('lag_max', 0) if writes else None,
+            'requests/s': (last[1].get('requests', 0) - first[1].get('requests', 0)) / (last[0] - first[0]),
+            'memory MB': memory,
+            'threads': threads}
+
+
+def print_results(results):
+    """ The function prints the results as a table
+    :param results: list of dict
+    :return: None
+    """
+    columns = list(results[0])
+    rows = [[('%.1f' % value if isinstance(value, float) else str(value)) for value in result.values()]
+            for result in results]
+    widths = [max(len(column), *[len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+
+    print('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+#######################################################################################################################
+#   Parsing Command Line Args                                                                                         #
+#######################################################################################################################
+def parse_args():
+    """ The function parse the args specified in the CLI.
+    :return: parsed args
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of the downloaders against a mock of relayr cloud and "
+                                                 "InfluxDB. The arguments after -- are passed to the script.")
+    parser.add_argument('--script', type=str, required=False, default='group', choices=['group', 'device'],
+                        help="Measure groups-raw-data-downloader.py or raw-data-downloader.py.")
+    parser.add_argument('--sizes', type=str, required=False, default='10,100,1000',
+                        help="Comma separated numbers of devices of the group, or of measurements of the device.")
+    parser.add_argument('--measurements', type=int, required=False, default=5,
+                        help="Number of measurements of every device of the group.")
+    parser.add_argument('--rate', type=float, required=False, default=1,
+                        help="Readings per second of every measurement.")
+    parser.add_argument('--latency', type=int, required=False, default=50,
+                        help="Milliseconds waited by the mock before answering every request to the cloud.")
+    parser.add_argument('--history', type=int, required=False, default=60,
+                        help="Seconds of readings available before the script is started.")
+    parser.add_argument('--duration', type=int, required=False, default=60,
+                        help="Seconds of every measure.")
+    parser.add_argument('--warmup', type=int, required=False, default=20,
+                        help="Seconds after the start of the script which are not measured.")
+    parser.add_argument('--engine', type=str, required=False, default='threads', choices=['threads', 'asyncio'],
+                        help="Engine of the script.")
+    parser.add_argument('--processes', type=str, required=False, default='1',
+                        help="Comma separated numbers of processes of the script, every size is measured with each.")
+    parser.add_argument('--work_dir', type=str, required=False, default=None,
+                        help="Folder of the files and of the logs of the script, by default a temporary folder.")
+
+    argv = sys.argv[1:]
+    extra = []
+    if '--' in argv:
+        extra = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    args.extra = extra
+
+    if args.warmup >= args.duration:
+        parser.error('the warm up must be shorter than the duration')
+
+    return args
+
+
+#######################################################################################################################
+#   Run                                                                                                               #
+#######################################################################################################################
+if __name__ == '__main__':
+    args = parse_args()
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='relayr-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    print('Files and logs of the script in ' + work_dir)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for processes in [int(processes) for processes in args.processes.split(',')]:
+            results.append(run_case(args, size, processes, work_dir))
+            print_results(results[-1:])
+
+    print()
+    print_results(results)
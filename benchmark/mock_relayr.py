@@ -0,0 +1,257 @@
+#######################################################################################################################
+#   Libraries, Modules & API                                                                                          #
+#######################################################################################################################
+import argparse
+import datetime
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#######################################################################################################################
+#   Global Variables                                                                                                  #
+#######################################################################################################################
+
+DEVICES = 0
+MEASUREMENTS = 0
+PERIOD = 0
+LATENCY = 0
+LIMIT = 0
+EXPIRES = 0
+
+# Milliseconds since the epoch of the first reading of every measurement.
+EPOCH = 0
+
+# The counters of the requests received and of the points written, read by the benchmark at /stats.
+STATS = {}
+LOCK = threading.Lock()
+
+
+#######################################################################################################################
+#   Functions                                                                                                         #
+#######################################################################################################################
+
+def format_timestamp(timestamp):
+    """ The function converts milliseconds since the epoch in a timestamp in ISO time format with milliseconds
+    :param timestamp: int
+    :return: str
+    """
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=timestamp)).strftime(
+        '%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_timestamp(timestamp):
+    """ The function converts in milliseconds since the epoch a timestamp in ISO time format, with or without
+        milliseconds, in the format of str(datetime) or in milliseconds
+    :param timestamp: str
+    :return: int
+    """
+    for timestamp_format in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S.%f',
+                             '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.datetime.strptime(timestamp, timestamp_format)
+        except ValueError:
+            continue
+        return (parsed - datetime.datetime(1970, 1, 1)) // datetime.timedelta(milliseconds=1)
+    return int(timestamp)
+
+
+def count(key, value=1):
+    """ The function increases a counter of the statistics
+    :param key: str
+    :param value: int
+    :return: None
+    """
+    with LOCK:
+        STATS[key] = STATS.get(key, 0) + value
+
+
+def readings(device, names, start, end, limit):
+    """ The function generates the readings of some measurements of a device between two timestamps, both included,
+        ordered by timestamp. Every measurement has a reading every PERIOD milliseconds from EPOCH.
+    :param device: str, the device id
+    :param names: list of str, the measurement names
+    :param start: int, milliseconds since the epoch
+    :param end: int, milliseconds since the epoch
+    :param limit: int, the maximum number of readings
+    :return: str, the JSON array of the readings
+    """
+    timestamp = EPOCH + max(-(-(start - EPOCH) // PERIOD), 0) * PERIOD
+    items = []
+
+    while timestamp <= end and len(items) < limit:
+        iso = format_timestamp(timestamp)
+        value = (timestamp // PERIOD) % 1000 / 10
+        for name in names[:limit - len(items)]:
+            items.append('{"deviceId":"%s","name":"%s","timestamp":"%s","value":%r}' % (device, name, iso, value))
+        timestamp += PERIOD
+
+    return '[' + ','.join(items) + ']'
+
+
+#######################################################################################################################
+#   Classes                                                                                                           #
+#######################################################################################################################
+
+class HandlerClass(BaseHTTPRequestHandler):
+    """ The class extends the BaseHTTPRequestHandler class. It answers as the login service and the API of relayr cloud
+        and as the write endpoint of InfluxDB, which counts the points and measures how old they are when written.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send(self, status, body=b'', content_type='application/json'):
+        """ The function sends an answer
+        :param status: int
+        :param body: bytes or str
+        :param content_type: str
+        :return: None
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The requests are not logged.
+        pass
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        # Login service.
+        if url.path in ('/oauth/token', '/oauth/refresh'):
+            count('logins' if url.path == '/oauth/token' else 'refreshes')
+            self.send(200, json.dumps({'accessToken': 'access-%f' % time.time(), 'refreshToken': 'refresh',
+                                       'expiresIn': EXPIRES}))
+            return
+
+        # InfluxDB.
+        if url.path == '/write':
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            self.write(body, query.get('precision', 'ns'))
+            self.send(204)
+            return
+
+        if url.path == '/query':
+            self.send(200, '{"results":[{"statement_id":0}]}')
+            return
+
+        # The maximum age of the points is measured again from now.
+        if url.path == '/stats/reset':
+            with LOCK:
+                STATS['lag_max'] = 0
+            self.send(204)
+            return
+
+        self.send(404, '{"error":"not found"}')
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.split('/')
+
+        if url.path == '/stats':
+            with LOCK:
+                self.send(200, json.dumps(STATS))
+            return
+
+        if url.path in ('/ping', '/query'):
+            self.send(200, '{"results":[{"statement_id":0}]}')
+            return
+
+        # The API of the cloud answers after the configured latency.
+        time.sleep(LATENCY / 1000)
+        count('requests')
+
+        if len(parts) == 4 and parts[1] == 'device-groups' and parts[3] == 'flat':
+            self.send(200, json.dumps({'devices': [{'id': 'dev-%d' % i} for i in range(DEVICES)]}))
+
+        elif len(parts) == 3 and parts[1] == 'devices':
+            self.send(200, json.dumps({'id': parts[2], 'name': 'name-' + parts[2], 'modelId': 'bench-model',
+                                       'modelVersion': 1}))
+
+        elif len(parts) == 5 and parts[1] == 'device-models':
+            self.send(200, json.dumps({'measurements': [{'name': 'm%d' % i, 'type': 'number'}
+                                                        for i in range(MEASUREMENTS)]}))
+
+        elif len(parts) == 4 and parts[1] == 'devices' and parts[3] == 'raw-measurements':
+            count('polls')
+            names = query['measurements'].split(',') if 'measurements' in query else \
+                ['m%d' % i for i in range(MEASUREMENTS)]
+            now = int(time.time() * 1000)
+            start = parse_timestamp(query['start']) if 'start' in query else now - 3600000
+            end = min(parse_timestamp(query['end']), now) if 'end' in query else now
+            self.send(200, readings(parts[2], names, start, end, int(query.get('limit', LIMIT))))
+
+        else:
+            self.send(404, '{"error":"not found"}')
+
+    def write(self, body, precision):
+        """ The function counts the points of a write and measures how old is its last point
+        :param body: bytes, the points in line protocol
+        :param precision: str, the precision of the timestamps
+        :return: None
+        """
+        lines = body.count(b'\n') + (0 if body.endswith(b'\n') else 1)
+        last = body.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+        timestamp = int(last.rsplit(b' ', 1)[1]) / {'ns': 1e6, 'u': 1e3, 'ms': 1, 's': 1e-3}[precision]
+        lag = time.time() - timestamp / 1000
+
+        with LOCK:
+            STATS['writes'] = STATS.get('writes', 0) + 1
+            STATS['points'] = STATS.get('points', 0) + lines
+            STATS['lag_sum'] = STATS.get('lag_sum', 0) + lag
+            STATS['lag_max'] = max(STATS.get('lag_max', 0), lag)
+
+
+#######################################################################################################################
+#   Parsing Command Line Args                                                                                         #
+#######################################################################################################################
+def parse_args():
+    """ The function parse the args specified in the CLI.
+    :return: parsed args
+    """
+    parser = argparse.ArgumentParser(description="Mock of relayr cloud and InfluxDB for the benchmark")
+    parser.add_argument('--port', type=int, required=True,
+                        help="Port where the mock is listening.")
+    parser.add_argument('--devices', type=int, required=False, default=10,
+                        help="Number of devices of the group.")
+    parser.add_argument('--measurements', type=int, required=False, default=5,
+                        help="Number of measurements of every device.")
+    parser.add_argument('--rate', type=float, required=False, default=1,
+                        help="Readings per second of every measurement.")
+    parser.add_argument('--latency', type=int, required=False, default=0,
+                        help="Milliseconds waited before answering every request to the API of the cloud.")
+    parser.add_argument('--history', type=int, required=False, default=3600,
+                        help="Seconds of readings available before the mock is started.")
+    parser.add_argument('--limit', type=int, required=False, default=10000,
+                        help="Maximum number of readings answered when the request has no limit.")
+    parser.add_argument('--expires', type=int, required=False, default=3600,
+                        help="Seconds of life of the access tokens.")
+    return parser.parse_args()
+
+
+#######################################################################################################################
+#   Run                                                                                                               #
+#######################################################################################################################
+if __name__ == '__main__':
+    args = parse_args()
+    DEVICES = args.devices
+    MEASUREMENTS = args.measurements
+    PERIOD = max(int(1000 / args.rate), 1)
+    LATENCY = args.latency
+    LIMIT = args.limit
+    EXPIRES = args.expires
+    EPOCH = (int(time.time()) - args.history) * 1000
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer(('127.0.0.1', args.port), HandlerClass).serve_forever()
@@ -0,0 +1,4119 @@
+#######################################################################################################################
+#   Libraries, Modules & API                                                                                          #
+#######################################################################################################################
+import sqlite3
+import shelve
+import dbm
+import json
+import requests
+import time
+import asyncio
+import argparse
+import threading
+import datetime
+import heapq
+import itertools
+import collections
+import queue
+import os
+import gzip
+import zlib
+import codecs
+import calendar
+import functools
+import random
+import math
+import bisect
+import hashlib
+import socket
+import signal
+import errno
+import csv
+import urllib.parse
+import email.utils
+import logging
+import http.server
+import concurrent.futures
+import multiprocessing
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+# aiohttp is needed only by the asyncio engine.
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# PyYAML is needed only to read config files in YAML.
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# pyarrow is needed only to write the points in Parquet files.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+#######################################################################################################################
+#   Global Variables                                                                                                  #
+#######################################################################################################################
+
+CLOUD_URL = ''
+LOGIN_URL = ''
+USER = ''
+PASSWORD = ''
+ORG = ''
+START = ''
+INFLUXDB_ADDRESS = ''
+INFLUXDB_PORT = 0
+DB = ''
+AUTH = None
+SPECIAL_CHAR = ''
+REFRESH = 0
+MIN_REFRESH = 0
+MAX_REFRESH = 0
+JITTER = 0
+WORKERS = 0
+ENGINE = ''
+CONCURRENCY = 0
+BACKFILL = False
+BACKFILL_WINDOW = 0
+BACKFILL_WORKERS = 0
+PAGE_LIMIT = 0
+CATCHUP_WORKERS = 0
+RESUME = False
+EXPORT_CURSORS = None
+IMPORT_CURSORS = None
+BATCH_SIZE = 0
+BATCH_TIME = 0
+FIELD_TYPES = ''
+ROLLUPS = []
+ROLLUPS_ONLY = False
+QUEUE_SIZE = 0
+SPOOL_DIR = ''
+SPOOL_SEGMENT = 0
+METADATA_TTL = 0
+SYNC_INTERVAL = 0
+SOURCES = []
+SHARDS = 1
+SHARD = 0
+RING = None
+PROCESSES = 1
+PROCESS = None
+RATE_LIMIT = 0
+RATE_BURST = 0
+BREAKER_FAILURES = 0
+BREAKER_TIME = 0
+LIMITER = None
+METRICS_PORT = None
+METRICS = None
+SINK = ''
+SINK_PATH = ''
+SINK_ROTATE = 0
+UDP_PORT = 0
+SHUTDOWN_TIMEOUT = 0
+SHUTDOWN = None
+
+# Size of the chunks in which the answers of the cloud are read.
+CHUNK_SIZE = 65536
+
+# Maximum difference in seconds between the last timestamps of the measurements requested together, so that the
+# readings downloaded again and skipped are few.
+MERGE_WINDOW = 300
+
+# Seconds after which a request to the cloud fails if the connection is not established or nothing is received.
+REQUEST_TIMEOUT = 60
+
+# Seconds of the first backoff after a failed request and maximum seconds of the backoff, which doubles at every
+# consecutive failure.
+BACKOFF_BASE = 1
+BACKOFF_MAX = 300
+
+# Maximum number of attempts of the requests of the info of the groups, of the devices and of the models.
+REQUEST_RETRIES = 3
+
+# Seconds after the end of a window of the rollups before it is closed without a later reading, so that the readings
+# received late by the cloud are aggregated as well.
+ROLLUP_DELAY = 60
+
+# Milliseconds of the units of the windows of the rollups and of the durations of their retention policies.
+DURATION_UNITS = {'s': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000, 'w': 604800000}
+
+# Compression level of the points written in influxdb with gzip: the lowest level already compresses the repeated
+# names and tags of line protocol well, at a fraction of the time of the higher ones.
+GZIP_LEVEL = 1
+
+# Maximum size in bytes of the datagrams of points sent to influxdb over UDP, below the 65536 bytes read at once by the
+# UDP listener of influxdb.
+UDP_PAYLOAD = 60000
+
+# Minimum number of rows of the row groups of the Parquet files merged at the end of their period.
+PARQUET_ROW_GROUP = 100000
+
+# Maximum number of warnings and errors logged with the same message every LOG_INTERVAL seconds.
+LOG_BURST = 10
+LOG_INTERVAL = 60
+
+# HTTP session shared by all the threads, it keeps alive the connections to the cloud.
+SESSION = requests.Session()
+
+# Logger of the script, configured with the level passed via command line.
+LOG = logging.getLogger('downloader')
+
+
+#######################################################################################################################
+#   Main                                                                                                              #
+#######################################################################################################################
+def main():
+
+    # Stop on SIGTERM and SIGINT writing the points already downloaded, in the processes forked after as well.
+    SHUTDOWN.install()
+
+    # Open the store of the last timestamps of the measurements.
+    checkpoint = CheckpointClass(str(DB) + '.sqlite', str(DB))
+
+    # If requested, only export the stored last timestamps.
+    if EXPORT_CURSORS is not None:
+        checkpoint.export(EXPORT_CURSORS)
+        LOG.info('Last timestamps exported to %s', EXPORT_CURSORS)
+        return
+
+    if IMPORT_CURSORS is not None:
+        checkpoint.load(IMPORT_CURSORS)
+        LOG.info('Last timestamps imported from %s', IMPORT_CURSORS)
+
+    # Connect to the sink of the points, which for influxdb waits until it is available.
+    sink = create_sink()
+    sink.connect(sorted(set(source['db'] for source in SOURCES)))
+    if SHUTDOWN.is_set():
+        return
+
+    # With more processes, the processes download and encode the points of their parts of the shard and pass them to
+    # the writer of this process through a shared queue. They are started by a supervisor process forked before any
+    # thread, so neither the supervisor nor the processes it starts again inherit locks held by other threads.
+    shared_queue = None
+    supervisor = None
+    if PROCESSES > 1:
+        context = multiprocessing.get_context('fork')
+        shared_queue = context.Queue(maxsize=QUEUE_SIZE)
+        supervisor = context.Process(target=supervise, args=(shared_queue,))
+        supervisor.start()
+
+    # Start the thread replaying the points which could not be written in the sink.
+    spool = SpoolClass(sink)
+    spool.start()
+
+    # Start the thread writing the points of all the poll jobs in the sink.
+    writer = WriterClass(sink, checkpoint, spool, shared_queue)
+    writer.start()
+
+    # Serve the metrics of the writer, and of the downloads when they run in this process.
+    METRICS.gauge('relayr_writer_queue_depth', writer.queue.qsize)
+    METRICS.gauge('relayr_spool_files', lambda: len(spool.segments()))
+    if METRICS_PORT is not None:
+        MetricsServerClass(METRICS_PORT).start()
+
+    try:
+        if PROCESSES == 1:
+            download(writer, checkpoint)
+        else:
+            # Without the supervisor nothing downloads anymore, so the script ends and can be started again.
+            while supervisor.is_alive() and not SHUTDOWN.wait(1):
+                pass
+            if not SHUTDOWN.is_set():
+                LOG.error('The supervisor of the processes ended with code %s: exiting', supervisor.exitcode)
+                os._exit(1)
+
+            # The supervisor stops the processes, which pass to the writer the points they downloaded before ending.
+            os.kill(supervisor.pid, signal.SIGTERM)
+            supervisor.join(SHUTDOWN.remaining())
+    except Exception:
+        # An error, as a rejected login or a device not found at the start, stops the script within the deadline and
+        # ends it with the error.
+        SHUTDOWN.stop('error')
+        raise
+    finally:
+        # Write the points in the queue and save their last timestamps.
+        writer.stop()
+        writer.join(SHUTDOWN.remaining())
+    LOG.info('Stopped: the download continues from the saved last timestamps at the next start')
+
+
+def supervise(shared_queue):
+    """ The function runs in a child process without threads the processes downloading the measurements, and starts
+        again the ones which end, until the main process ends
+    :param shared_queue: multiprocessing.Queue, the queue of the writer of the main process
+    :return: None
+    """
+    global SHUTDOWN_TIMEOUT
+
+    context = multiprocessing.get_context('fork')
+    parent = os.getppid()
+    processes = [None] * PROCESSES
+
+    # The processes stop within half of the time of the stop, so the writer has the other half to write their points.
+    SHUTDOWN_TIMEOUT = SHUTDOWN_TIMEOUT / 2
+
+    while os.getppid() == parent:
+        for index in range(PROCESSES):
+            if processes[index] is not None:
+                if processes[index].is_alive():
+                    continue
+                LOG.error('The process %d ended with code %s: starting it again', index, processes[index].exitcode)
+
+            processes[index] = context.Process(target=process_main, args=(shared_queue, index))
+            processes[index].start()
+
+        if SHUTDOWN.wait(5):
+            break
+
+    if not SHUTDOWN.is_set():
+        # The processes end by themselves once the supervisor ends.
+        os._exit(1)
+
+    # Stop the processes and wait until they passed their points to the writer.
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    for process in processes:
+        process.join(SHUTDOWN.remaining())
+    os._exit(0)
+
+
+def process_main(shared_queue, index):
+    """ The function runs in a child process the downloads of a part of the shard of this instance of the script
+    :param shared_queue: multiprocessing.Queue, the queue of the writer of the main process
+    :param index: int, the index of the process
+    :return: None
+    """
+    global PROCESS, RATE_LIMIT, RATE_BURST, LIMITER, METRICS
+
+    # Every process downloads the measurements of the shard of this instance with the same index in owns(), so the
+    # number of processes does not change the measurements downloaded by every instance.
+    PROCESS = index
+
+    # The processes share the limit and the burst of the requests of the instance, every process can send a request.
+    RATE_LIMIT = RATE_LIMIT / PROCESSES
+    RATE_BURST = max(RATE_BURST // PROCESSES, 1)
+    LIMITER = LimiterClass()
+
+    # Every process serves its own metrics, on the ports following the one of the main process.
+    METRICS = MetricsClass()
+    if METRICS_PORT is not None:
+        MetricsServerClass(METRICS_PORT + 1 + index).start()
+
+    # The process stops when the supervisor ends.
+    ParentClass(os.getppid()).start()
+
+    # The process reads the stored last timestamps with its own connection, they are saved by the main process.
+    download(ProcessWriterClass(shared_queue), CheckpointClass(str(DB) + '.sqlite', str(DB)))
+
+
+def download(writer, checkpoint):
+    """ The function logs in the cloud and downloads the measurements of the devices
+    :param writer: WriterClass or ProcessWriterClass
+    :param checkpoint: CheckpointClass
+    :return: None
+    """
+    global AUTH
+
+    AUTH = TokenClass()
+    METRICS.gauge('relayr_token_valid', AUTH.valid.is_set)
+
+    # With the asyncio engine all the requests run on one event loop.
+    if ENGINE == 'asyncio':
+        asyncio.run(async_main(writer, checkpoint))
+        return
+
+    # Log in the cloud and keep the access token valid in a thread.
+    AUTH.login()
+    AUTH.start()
+
+    # Let the session keep alive one connection for every worker thread.
+    SESSION.mount(CLOUD_URL, requests.adapters.HTTPAdapter(pool_maxsize=WORKERS))
+
+    # Create the scheduler with a fixed number of worker threads.
+    scheduler = SchedulerClass(WORKERS)
+
+    # Create the poll jobs of the devices of the groups and of the single devices. The devices of the groups and their
+    # info are read from the cache also if expired, so after a restart the polls start at once, continuing from the
+    # stored last timestamps, and only the ones not cached are requested. The first update of the jobs requests the
+    # expired ones again.
+    metadata = MetadataClass()
+    devices = get_devices(metadata, True)
+    reconciler = ReconcilerClass(writer, checkpoint, metadata, scheduler)
+    reconciler.reconcile(devices, metadata.get(list(devices), True))
+    check_devices(reconciler)
+    METRICS.gauge('relayr_stream_lag_seconds', reconciler.lags)
+    METRICS.gauge('relayr_scheduled_jobs', lambda: len(scheduler.queue))
+
+    # Start the worker threads and keep the jobs updated until the script is stopping.
+    scheduler.start()
+    reconciler.run(0 if metadata.stale else SYNC_INTERVAL)
+
+    # Let the running polls pass their points to the writer.
+    scheduler.join(SHUTDOWN.remaining())
+
+
+async def async_main(writer, checkpoint):
+    """ The function does the same as download() with the asyncio engine: the token refresh, the device and model
+        requests and the polls of the measurements run on one event loop.
+    :param writer: WriterClass
+    :param checkpoint: CheckpointClass
+    :return: None
+    """
+    engine = AsyncEngineClass()
+
+    # The session is closed also when the start fails.
+    try:
+        # Log in the cloud and keep the access token valid in a task, referenced until the event loop is closed.
+        token_task = await AUTH.async_start(engine)
+
+        # Create the poll jobs of the devices of the groups and of the single devices, reading from the cache the
+        # devices of the groups and their info as download() does, and getting concurrently the ones not cached. Keep
+        # the jobs updated in a task.
+        metadata = MetadataClass()
+        devices = await async_get_devices(engine, metadata, True)
+        reconciler = ReconcilerClass(writer, checkpoint, metadata, engine)
+        reconciler.reconcile(devices, await metadata.async_get(engine, list(devices), True))
+        check_devices(reconciler)
+        METRICS.gauge('relayr_stream_lag_seconds', reconciler.lags)
+        METRICS.gauge('relayr_scheduled_jobs', lambda: len(engine.tasks))
+        engine.spawn(reconciler.async_run(engine, 0 if metadata.stale else SYNC_INTERVAL))
+
+        await engine.run_forever()
+    finally:
+        await engine.session.close()
+
+
+def get_devices(metadata, cached=False):
+    """ The function lists the devices to download: the devices of the groups, requested to the cloud, and the single
+        devices. A device in more sources is downloaded once, with the options of the first source.
+    :param metadata: MetadataClass, the cache of the devices of the groups
+    :param cached: bool, True to request only the groups whose devices are not cached
+    :return: dict, the source of every device id
+    """
+    # Request the group info.
+    groups = metadata.missing_groups(cached)
+    metadata.store_groups(groups, [get_json(CLOUD_URL + '/device-groups/' + group + '/flat') for group in groups])
+
+    return metadata.sources()
+
+
+async def async_get_devices(engine, metadata, cached=False):
+    """ The function does the same as get_devices() with the asyncio engine, requesting all the groups at the same time
+    :param engine: AsyncEngineClass
+    :param metadata: MetadataClass, the cache of the devices of the groups
+    :param cached: bool, True to request only the groups whose devices are not cached
+    :return: dict, the source of every device id
+    """
+    # Request the info of the groups.
+    groups = metadata.missing_groups(cached)
+    metadata.store_groups(groups, await asyncio.gather(*[engine.get_json(CLOUD_URL + '/device-groups/' + group +
+                                                                         '/flat') for group in groups]))
+
+    return metadata.sources()
+
+
+def check_devices(reconciler):
+    """ The function stops the script if the info of a device given by its id are not available
+    :param reconciler: ReconcilerClass
+    :return: None
+    """
+    for source in SOURCES:
+        if source['kind'] == 'device' and source['id'] not in reconciler.model_keys:
+            raise RuntimeError('Impossible to get the info of the device ' + source['id'])
+
+
+def create_raw_class(writer, checkpoint, source, device_req_json, measurements_names, schema):
+    """ The function creates the poll job of a device
+    :param writer: WriterClass
+    :param checkpoint: CheckpointClass
+    :param source: dict, the group or the device which the device comes from
+    :param device_req_json: dict, the device info
+    :param measurements_names: list of str, the names of the measurements to download
+    :param schema: SchemaClass, the encoders of the measurements of the model of the device
+    :return: RawClass
+    """
+    LOG.info('Downloading data for device %s (%s)', device_req_json['name'], device_req_json['id'])
+
+    LOG.info('Measurements to download:')
+    for i in range(len(measurements_names)):
+        LOG.info('%s', measurements_names[i])
+
+    # The points are tagged with the name of the device when more devices can be saved in the same database.
+    tags = {'device': device_req_json['name']} if source['tag'] else {}
+
+    # Create a job passing the writer, the device and the names of the measurements to download.
+    return RawClass(writer, checkpoint, source, device_req_json['id'], device_req_json['name'], measurements_names,
+                    tags, schema)
+
+
+#######################################################################################################################
+#   Functions                                                                                                         #
+#######################################################################################################################
+
+def validate_isodate(isodate):
+    """ The function check if a string is a date in ISO time format
+    :param isodate: timestamp in a format to check if the date is in ISO format
+    :return: Boolean, False if the date is not in ISO format
+    """
+    try:
+        datetime.datetime.strptime(isodate, "%Y-%m-%dT%H:%M:%SZ")
+        LOG.info('Date parameter is in a valid ISO format.')
+    except ValueError:
+        pass
+        LOG.warning('Incorrect data format, should be YYYY-mm-ddTHH:MM:SSZ')
+        return False
+    return True
+
+
+def load_config(path):
+    """ The function reads the groups and the devices to download from a YAML or JSON file
+    :param path: str
+    :return: list of dict, the sources of the devices
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise RuntimeError('PyYAML is needed to read the config file ' + path)
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+
+    # The single devices come before the groups, so that their options are used if they are also in a group.
+    sources = []
+    for options in config.get('devices', []):
+        sources.append(make_source('device', options, True))
+    for options in config.get('groups', []):
+        sources.append(make_source('group', options, True))
+
+    return sources
+
+
+def make_source(kind, options, tag):
+    """ The function creates a source of devices to download, completing its options with the command line ones
+    :param kind: str, 'group' or 'device'
+    :param options: dict, the id of the group or of the device and its own options
+    :param tag: bool, True to tag the points with the name of the device
+    :return: dict
+    """
+    refresh = options.get('refresh', REFRESH)
+
+    return {'kind': kind,
+            'id': options['id'],
+            'tag': tag,
+            'db': options.get('db', DB),
+            'special_char': options.get('special_char', SPECIAL_CHAR),
+            'refresh': refresh,
+            'min_refresh': options.get('min_refresh', MIN_REFRESH if MIN_REFRESH is not None else refresh),
+            'max_refresh': options.get('max_refresh', MAX_REFRESH if MAX_REFRESH is not None else refresh)}
+
+
+def schedule_raw_classes(scheduler, raw_class_list):
+    """ The function schedules the poll jobs of the devices, after their history if the backfill is requested
+    :param scheduler: SchedulerClass or AsyncEngineClass
+    :param raw_class_list: list of RawClass
+    :return: None
+    """
+    if BACKFILL:
+        backfill = BackfillClass(scheduler)
+        for raw_class in raw_class_list:
+            backfill.add(raw_class)
+        backfill.start()
+        return
+
+    # Spread the first polls over the refresh period, so the jobs do not run all in the same instant.
+    for i in range(len(raw_class_list)):
+        scheduler.schedule(raw_class_list[i], raw_class_list[i].source['refresh'] * i / len(raw_class_list))
+
+
+def cloud_get(url, params=None, stream=False):
+    """ The function sends a GET request to the cloud with the current token, when the limiter of the requests lets it
+    :param url: str
+    :param params: dict, query parameters
+    :param stream: bool, True to read the answer while it is received
+    :return: requests.Response, with a successful status
+    """
+    endpoint = LIMITER.endpoint(url)
+    attempt = 1
+
+    while True:
+        token = AUTH.get()
+        time.sleep(LIMITER.acquire(endpoint))
+
+        try:
+            resp = SESSION.get(url, params=params, headers={'authorization': 'Bearer ' + token}, stream=stream,
+                               timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            LIMITER.answered(endpoint, None, None)
+            raise
+        LIMITER.answered(endpoint, resp.status_code, resp.headers.get('Retry-After'))
+
+        # A rejected token is replaced and the request is sent again once, with the new token.
+        if resp.status_code == 401:
+            AUTH.rejected(token)
+            if attempt == 1:
+                resp.close()
+                attempt += 1
+                continue
+
+        # An answer with an error status does not contain the requested JSON.
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError:
+            resp.close()
+            raise
+        return resp
+
+
+def get_json(url, params=None):
+    """ The function sends a GET request to the cloud with the current token, trying again up to REQUEST_RETRIES times
+        when the cloud is not available or too many requests are sent
+    :param url: str
+    :param params: dict, query parameters
+    :return: the parsed JSON received as answer
+    """
+    attempt = 1
+    while True:
+        try:
+            with cloud_get(url, params) as resp:
+                return resp.json()
+        except Exception as e:
+            if attempt == REQUEST_RETRIES or not is_transient(e):
+                raise
+            attempt += 1
+            time.sleep(LIMITER.remaining(LIMITER.endpoint(url)))
+
+
+def device_url(device):
+    """ The function returns the url of the info of a device
+    :param device: str, the device id
+    :return: str
+    """
+    return CLOUD_URL + '/devices/' + device
+
+
+def model_key(device_req_json):
+    """ The function returns the key identifying the model of a device and its version
+    :param device_req_json: dict, the device info
+    :return: str
+    """
+    return device_req_json['modelId'] + '/versions/' + str(device_req_json['modelVersion'])
+
+
+def model_url(key):
+    """ The function returns the url of the info of a model
+    :param key: str, the key returned by model_key()
+    :return: str
+    """
+    return CLOUD_URL + '/device-models/' + key
+
+
+def get_measurements_names(model_req_json, special_char, device):
+    """ The function extracts from the model info the names of the measurements to download
+    :param model_req_json: dict, the model info
+    :param special_char: str, the char contained in the names of the measurements to download, None for all
+    :param device: str, the device id
+    :return: list of str
+    """
+    measurements_names = []
+
+    # Cycle all the measurements.
+    for i in range(len(model_req_json['measurements'])):
+        name = model_req_json['measurements'][i]['name']
+
+        # If there is the special character append only the measurements containing the special char, otherwise append
+        # all the measurements.
+        if special_char is not None and special_char not in name:
+            continue
+
+        # With more instances or processes, append only the measurements of the shard of this process.
+        if not owns(device, name):
+            continue
+
+        measurements_names.append(name)
+
+    return measurements_names
+
+
+def format_timestamp(timestamp):
+    """ The function converts milliseconds since the epoch in a timestamp in ISO time format with milliseconds, the
+        format of the API of the cloud
+    :param timestamp: int
+    :return: str
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp // 1000)) + '.%03dZ' % (timestamp % 1000)
+
+
+@functools.lru_cache(maxsize=1024)
+def day_to_ms(day):
+    """ The function converts a date in milliseconds since the epoch of its midnight
+    :param day: str, the date as YYYY-mm-dd
+    :return: int
+    """
+    return calendar.timegm((int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0)) * 1000
+
+
+def parse_timestamp(timestamp):
+    """ The function converts in milliseconds since the epoch a timestamp in ISO time format, with or without
+        milliseconds. The timestamps of the readings, YYYY-mm-ddTHH:MM:SS.fffZ, are parsed by position without strptime.
+        The milliseconds and the format of str(datetime), used by the versions before to save the last timestamps, are
+        accepted as well.
+    :param timestamp: str or int
+    :return: int
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+
+    if len(timestamp) == 24 and timestamp[10] == 'T' and timestamp[19] == '.' and timestamp[23] == 'Z':
+        return (day_to_ms(timestamp[:10]) + int(timestamp[11:13]) * 3600000 + int(timestamp[14:16]) * 60000 +
+                int(timestamp[17:19]) * 1000 + int(timestamp[20:23]))
+
+    if timestamp.isdigit():
+        return int(timestamp)
+
+    for timestamp_format in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S.%f',
+                             '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.datetime.strptime(timestamp, timestamp_format)
+        except ValueError:
+            continue
+        return calendar.timegm(parsed.timetuple()) * 1000 + parsed.microsecond // 1000
+    raise ValueError('Unknown timestamp format: ' + timestamp)
+
+
+def escape(value, chars):
+    """ The function escapes with a backslash some characters of a name for line protocol
+    :param value: str
+    :param chars: str, the characters to escape
+    :return: str
+    """
+    for char in chars:
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def float_value(value):
+    """ The function encodes a value as a float field of line protocol
+    :param value: the value of a reading
+    :return: bytes, None if the value is not a finite number
+    """
+    # The integers too large for a float raise OverflowError.
+    try:
+        value = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+    # InfluxDB refuses the whole batch with a value which is not a finite number.
+    if not math.isfinite(value):
+        return None
+    return b'%r' % value
+
+
+def integer_value(value):
+    """ The function encodes a value as an integer field of line protocol
+    :param value: the value of a reading
+    :return: bytes, None if the value is not an integer
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+
+    # InfluxDB stores the integers in 64 bits.
+    if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+        return None
+    return b'%di' % value
+
+
+def boolean_value(value):
+    """ The function encodes a value as a boolean field of line protocol
+    :param value: the value of a reading
+    :return: bytes, None if the value is not a boolean
+    """
+    if value is True or value == 'true':
+        return b'true'
+    if value is False or value == 'false':
+        return b'false'
+    return None
+
+
+def string_value(value):
+    """ The function encodes a value as a string field of line protocol, the objects and the arrays in JSON
+    :param value: the value of a reading
+    :return: bytes
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value)
+
+    # The new lines are escaped as well, since the writer and the spool handle the points one per line.
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    return b'"' + value.encode('utf-8') + b'"'
+
+
+def any_value(value):
+    """ The function encodes a value as a field of line protocol with the type of its JSON value. The numbers are
+        always encoded as floats, since a field of InfluxDB keeps the type of its first value and the same value can
+        be sent as 1 and as 1.5.
+    :param value: the value of a reading
+    :return: bytes, None if the value cannot be encoded
+    """
+    if isinstance(value, bool):
+        return boolean_value(value)
+    if isinstance(value, (int, float)):
+        return float_value(value)
+    if isinstance(value, str):
+        return string_value(value)
+    return None
+
+
+def value_fields(encode, value):
+    """ The function encodes a value in the field named value
+    :param encode: function, the encoder of the value
+    :param value: the value of a reading
+    :return: bytes, the fields of line protocol, None if the value cannot be encoded
+    """
+    encoded = encode(value)
+    if encoded is None:
+        return None
+    return b'value=' + encoded
+
+
+def object_fields(value, key='', fields=None):
+    """ The function encodes an object or an array in one field for every value it contains, named with the path of
+        the value joined by dots, e.g. {"position": {"x": 1}} in position.x=1.0
+    :param value: the value of a reading, or a value nested in it
+    :param key: str, the path of the value
+    :param fields: list of bytes, the fields encoded so far
+    :return: bytes, the fields of line protocol, None if the object contains no value which can be encoded
+    """
+    if fields is None:
+        fields = []
+
+    if isinstance(value, dict):
+        for name in sorted(value):
+            object_fields(value[name], key + '.' + str(name) if key else str(name), fields)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            object_fields(item, key + '.' + str(i) if key else str(i), fields)
+    else:
+        encoded = any_value(value)
+        if encoded is not None:
+            fields.append(escape(key or 'value', ',= ').encode('utf-8') + b'=' + encoded)
+
+    if len(fields) == 0:
+        return None
+    return b','.join(fields)
+
+
+def any_fields(value):
+    """ The function encodes a value of a measurement without a known type
+    :param value: the value of a reading
+    :return: bytes, the fields of line protocol, None if the value cannot be encoded
+    """
+    if isinstance(value, (dict, list)):
+        return object_fields(value)
+    return value_fields(any_value, value)
+
+
+def iter_readings(chunks):
+    """ The function parses incrementally the JSON array of readings received from the cloud, one reading at a time
+    :param chunks: iterable of bytes, the answer as it is received
+    :return: generator of dict
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    text = ''
+    position = 0
+    started = False
+
+    for chunk in chunks:
+        text = text[position:] + utf8.decode(chunk)
+        position = 0
+
+        while True:
+            # Skip the spaces and the commas between the readings.
+            while position < len(text) and text[position] in ' \t\r\n,':
+                position += 1
+            if position == len(text):
+                break
+
+            # The answer must be an array, otherwise it is an error message.
+            if not started:
+                if text[position] != '[':
+                    raise ValueError('Unexpected answer: ' + text[position:position + 200])
+                started = True
+                position += 1
+                continue
+
+            if text[position] == ']':
+                return
+
+            # If the reading is not complete, wait for the next chunk.
+            try:
+                reading, position = decoder.raw_decode(text, position)
+            except ValueError:
+                break
+            yield reading
+
+    # The answer ended before the end of the array.
+    raise ValueError('Incomplete answer: ' + text[position:position + 200])
+
+
+def create_retention_policy(influxClient, db, rp, duration):
+    """ The function creates a retention policy of the rollups, or changes its duration if it already exists
+    :param influxClient: InfluxDBClient
+    :param db: str, the database
+    :param rp: str, the name of the retention policy
+    :param duration: str, the duration in the format of influxdb
+    :return: None
+    """
+    try:
+        influxClient.create_retention_policy(rp, duration, 1, database=db)
+    except InfluxDBClientError as e:
+        if 'already exists' not in str(e):
+            raise
+        influxClient.alter_retention_policy(rp, database=db, duration=duration)
+
+
+def write_lines(influxClient, db, data, rp=None, compress=False):
+    """ The function writes in influxdb points already encoded with line protocol
+    :param influxClient: InfluxDBClient
+    :param db: str, the database
+    :param data: bytes
+    :param rp: str, the retention policy, None for the default one of the database
+    :param compress: bool, True to send the points compressed with gzip
+    :return: None
+    """
+    params = {'db': db, 'precision': 'ms'}
+    if rp is not None:
+        params['rp'] = rp
+    headers = {'Content-Type': 'application/octet-stream'}
+    if compress:
+        data = gzip.compress(data, GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    influxClient.request(url='write', method='POST', params=params, data=data, expected_response_code=204,
+                         headers=headers)
+
+
+def find_unescaped(text, char, start=0):
+    """ The function finds in a part of a line of line protocol a character which is not escaped by a backslash
+    :param text: str
+    :param char: str, one character
+    :param start: int, the position from where the character is searched
+    :return: int, -1 if the character is not found
+    """
+    position = text.find(char, start)
+    while position > 0 and text[position - 1] == '\\':
+        position = text.find(char, position + 1)
+    return position
+
+
+def split_fields(text):
+    """ The function splits the fields of a line of line protocol at the commas which are not escaped and not in a
+        string value
+    :param text: str
+    :return: list of str
+    """
+    if '\\' not in text and '"' not in text:
+        return text.split(',')
+
+    fields = []
+    start = 0
+    quoted = False
+    i = 0
+    while i < len(text):
+        if text[i] == '\\':
+            i += 1
+        elif text[i] == '"':
+            quoted = not quoted
+        elif text[i] == ',' and not quoted:
+            fields.append(text[start:i])
+            start = i + 1
+        i += 1
+    fields.append(text[start:])
+    return fields
+
+
+def unescape(value, chars):
+    """ The function removes the backslashes escaping some characters of a name of line protocol, as done by escape
+    :param value: str
+    :param chars: str, the escaped characters
+    :return: str
+    """
+    for char in chars:
+        value = value.replace('\\' + char, char)
+    return value
+
+
+def decode_value(value):
+    """ The function decodes the value of a field of line protocol, as encoded by the encoders of the values
+    :param value: str
+    :return: float, int, bool or str
+    """
+    if value.startswith('"'):
+        # The escaped backslashes are split first, so the backslashes escaping them are not read as escapes.
+        return '\\'.join(part.replace('\\"', '"').replace('\\n', '\n').replace('\\r', '\r')
+                          for part in value[1:-1].split('\\\\'))
+    if value.endswith('i'):
+        return int(value[:-1])
+    if value in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if value in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    return float(value)
+
+
+def decode_points(data):
+    """ The function decodes points encoded with line protocol, one row for every field of every point
+    :param data: bytes
+    :return: generator of tuples, the timestamp, the measurement, the tag set as in line protocol, the name and the
+        value of the field
+    """
+    # The lines are split only at the new lines, the other line breaks of unicode can be in the string values.
+    for line in data.decode('utf-8').split('\n'):
+        if len(line) == 0:
+            continue
+
+        # The timestamp has no spaces, while the string values can have them.
+        rest, timestamp = line.rsplit(' ', 1)
+        position = find_unescaped(rest, ' ')
+        key, fields = rest[:position], rest[position + 1:]
+
+        position = find_unescaped(key, ',')
+        measurement, tags = (key, '') if position == -1 else (key[:position], key[position + 1:])
+        measurement = unescape(measurement, ', ')
+
+        for field in split_fields(fields):
+            position = find_unescaped(field, '=')
+            yield int(timestamp), measurement, tags, unescape(field[:position], ',= '), \
+                decode_value(field[position + 1:])
+
+
+def create_sink():
+    """ The function creates the sink where the points are written, chosen with SINK
+    :return: the sink
+    """
+    if SINK == 'udp':
+        return UdpSinkClass()
+    if SINK == 'parquet':
+        return ParquetSinkClass()
+    if SINK == 'csv':
+        return CsvSinkClass()
+    if SINK == 'sqlite':
+        return SqliteSinkClass()
+    return InfluxSinkClass(SINK == 'influxdb_gzip')
+
+
+def parse_duration(value):
+    """ The function converts in milliseconds a duration written as a number and a unit, e.g. 5m
+    :param value: str
+    :return: int
+    """
+    if len(value) < 2 or value[-1] not in DURATION_UNITS or not value[:-1].isdigit() or int(value[:-1]) == 0:
+        raise ValueError('invalid duration %r, it should be a number followed by one of %s' % (
+            value, ', '.join(DURATION_UNITS)))
+    return int(value[:-1]) * DURATION_UNITS[value[-1]]
+
+
+def parse_rollups(value):
+    """ The function parses the windows of the rollups and the durations of their retention policies. Every window
+        must divide the longest one, so that the windows of all the rollups end together at its end.
+    :param value: str, comma separated windows, each optionally followed by a colon and a duration or inf
+    :return: list of tuples, the window in milliseconds, the name and the duration of the retention policy, sorted
+        by window
+    """
+    rollups = []
+    for rollup in value.split(','):
+        window, duration = rollup.split(':', 1) if ':' in rollup else (rollup, 'inf')
+        window = window.strip()
+        duration = duration.strip().lower()
+
+        # InfluxDB keeps the points of a retention policy at least for an hour.
+        if duration == 'inf':
+            duration = 'INF'
+        elif parse_duration(duration) < DURATION_UNITS['h']:
+            raise ValueError('the duration %s of the rollups is shorter than an hour' % duration)
+        rollups.append((parse_duration(window), 'rollup_' + window, duration))
+
+    rollups.sort()
+    if len(set(rollup[0] for rollup in rollups)) != len(rollups):
+        raise ValueError('the windows of the rollups must be different')
+    for rollup in rollups:
+        if rollups[-1][0] % rollup[0] != 0:
+            raise ValueError('the window %s does not divide the longest window of the rollups' % rollup[1][7:])
+    return rollups
+
+
+def ring_hash(key):
+    """ The function hashes a key in the same way in all the instances of the script
+    :param key: str
+    :return: int
+    """
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def owns(device, name):
+    """ The function tells if a measurement of a device is downloaded by this process: the ring assigns it to an
+        instance of the script, then a second hash assigns it to one of the processes of the instance
+    :param device: str, the device id
+    :param name: str, the measurement name
+    :return: bool
+    """
+    if RING is not None and RING.shard(device, name) != SHARD:
+        return False
+    return PROCESS is None or ring_hash('process/' + device + '/' + name) % PROCESSES == PROCESS
+
+
+def is_retryable(error):
+    """ The function tells if a write in influxdb failed because influxdb is not available, so it can be retried, or
+        because influxdb refused the points, for example for a conflict of the type of a field
+    :param error: Exception
+    :return: bool
+    """
+    return not isinstance(error, InfluxDBClientError) or error.code is None or error.code in (408, 429) or \
+        error.code >= 500
+
+
+def is_transient(error):
+    """ The function tells if a request to the cloud failed because the cloud is not available or too many requests
+        are sent, so it can be retried later, or because the request is wrong
+    :param error: Exception
+    :return: bool
+    """
+    if isinstance(error, (BlockedError, requests.ConnectionError, requests.Timeout, asyncio.TimeoutError)):
+        return True
+
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code
+    elif aiohttp is not None and isinstance(error, aiohttp.ClientResponseError):
+        status = error.status
+    else:
+        return aiohttp is not None and isinstance(error, aiohttp.ClientError)
+
+    return status == 429 or status >= 500
+
+
+def parse_retry_after(value):
+    """ The function converts the Retry-After header, in seconds or as an HTTP date, in seconds from now
+    :param value: str, None if the header is missing
+    :return: float, None if the header is missing or not valid
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(failures):
+    """ The function returns the time to wait after some consecutive failures: it doubles at every failure up to
+        BACKOFF_MAX seconds, and a random part of it avoids that all the requests are retried at the same time.
+    :param failures: int
+    :return: float, seconds
+    """
+    delay = min(BACKOFF_BASE * 2 ** min(failures - 1, 32), BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+#######################################################################################################################
+#   Classes                                                                                                           #
+#######################################################################################################################
+
+class TokenClass(threading.Thread):
+    """ The class extends the Thread class. It logs in the cloud and keeps the access token valid: when it runs, it
+        requests a new access token with the refresh token once three quarters of the life of the token passed, or as
+        soon as the cloud rejects the token. When the refresh token is rejected, it logs in again with the user and the
+        password. A failed request is tried again with backoff, so the thread never stops. With the asyncio engine the
+        same runs as a task of the event loop, with the session of the engine, instead of the thread.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.lock = threading.Lock()
+        self.token = ''
+        self.refresh_token = ''
+        self.renewal = 0
+
+        # The valid event is cleared while a rejected token is replaced, so the requests wait for the new token. The
+        # renew event asks to replace the token at once.
+        self.valid = threading.Event()
+        self.renew = threading.Event()
+
+        # The same events for the tasks of the asyncio engine, created on its event loop.
+        self.async_valid = None
+        self.async_renew = None
+
+    def get(self):
+        """ The function returns the current access token, waiting while a rejected token is replaced
+        :return: str
+        """
+        self.valid.wait(REQUEST_TIMEOUT)
+        with self.lock:
+            return self.token
+
+    async def async_get(self):
+        """ The function does the same as get() without blocking the event loop
+        :return: str
+        """
+        try:
+            await asyncio.wait_for(self.async_valid.wait(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        with self.lock:
+            return self.token
+
+    def rejected(self, token):
+        """ The function asks a new access token when the cloud rejects the current one
+        :param token: str, the rejected token
+        :return: None
+        """
+        with self.lock:
+            # The token is already being replaced.
+            if token != self.token or not self.valid.is_set():
+                return
+            self.valid.clear()
+
+        LOG.warning('The access token was rejected by the cloud')
+        self.renew.set()
+
+        # With the asyncio engine the token is rejected by a task of the event loop.
+        if self.async_renew is not None:
+            self.async_valid.clear()
+            self.async_renew.set()
+
+    def login(self):
+        """ The function logs in the cloud with the user and the password, receiving a refresh token
+        :return: None
+        """
+        LOG.info("Acquiring a new refresh token")
+        resp = SESSION.post(LOGIN_URL + '/oauth/token?client_id=api-client',
+                            data={'username': USER, 'password': PASSWORD, 'org': ORG}, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        self.save(resp.json())
+        LOG.info("Refresh token saved")
+
+    def refresh(self):
+        """ The function requests a new access token with the refresh token
+        :return: None
+        """
+        LOG.info('Requesting a new access token...')
+        resp = SESSION.post(LOGIN_URL + '/oauth/refresh?client_id=api-client',
+                            headers={'Content-Type': 'application/json'}, json={'refresh_token': self.refresh_token},
+                            timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        self.save(resp.json())
+        LOG.info('New access token saved')
+
+    async def async_login(self, engine):
+        """ The function does the same as login() with the session of the asyncio engine
+        :param engine: AsyncEngineClass
+        :return: None
+        """
+        LOG.info("Acquiring a new refresh token")
+        self.save(await engine.post_json(LOGIN_URL + '/oauth/token?client_id=api-client',
+                                         data={'username': USER, 'password': PASSWORD, 'org': ORG}))
+        LOG.info("Refresh token saved")
+
+    async def async_refresh(self, engine):
+        """ The function does the same as refresh() with the session of the asyncio engine
+        :param engine: AsyncEngineClass
+        :return: None
+        """
+        LOG.info('Requesting a new access token...')
+        self.save(await engine.post_json(LOGIN_URL + '/oauth/refresh?client_id=api-client',
+                                         json={'refresh_token': self.refresh_token}))
+        LOG.info('New access token saved')
+
+    def save(self, answer):
+        """ The function replaces the tokens with the ones received from the login service and lets the requests use
+            them
+        :param answer: dict, the parsed JSON received as answer
+        :return: None
+        """
+        token = answer['accessToken']
+
+        with self.lock:
+            self.token = token
+            self.refresh_token = answer.get('refreshToken', self.refresh_token)
+
+            # Without its life, the token is replaced at once.
+            self.renewal = time.monotonic() + answer.get('expiresIn', 0) * 3 / 4
+        self.valid.set()
+        if self.async_valid is not None:
+            self.async_valid.set()
+
+    def run(self):
+        failures = 0
+
+        while True:
+            with self.lock:
+                delay = self.renewal - time.monotonic()
+            self.renew.wait(max(delay, 0))
+            self.renew.clear()
+
+            try:
+                try:
+                    self.refresh()
+                except requests.HTTPError as e:
+                    if e.response.status_code not in (400, 401, 403):
+                        raise
+
+                    # The refresh token is not valid anymore, a new one is received logging in again.
+                    LOG.warning('The refresh token was rejected by the cloud: %s', e)
+                    self.login()
+                failures = 0
+                METRICS.inc('relayr_token_renewals_total', labels=(('result', 'ok'),))
+            except Exception as e:
+                METRICS.inc('relayr_token_renewals_total', labels=(('result', 'error'),))
+                failures += 1
+                delay = backoff(failures)
+                LOG.error('Error renewing the access token, retrying in %.1fs: %s', delay, e)
+                with self.lock:
+                    self.renewal = time.monotonic() + delay
+
+    async def async_start(self, engine):
+        """ The function does the same as login() and start() with the asyncio engine: it logs in the cloud and keeps
+            the access token valid in a task of the event loop, which runs until the event loop is closed
+        :param engine: AsyncEngineClass
+        :return: asyncio.Task
+        """
+        self.async_valid = asyncio.Event()
+        self.async_renew = asyncio.Event()
+        await self.async_login(engine)
+        return asyncio.ensure_future(self.async_run(engine))
+
+    async def async_run(self, engine):
+        """ The function does the same as run() as a task of the event loop of the asyncio engine
+        :param engine: AsyncEngineClass
+        :return: None
+        """
+        failures = 0
+
+        while True:
+            with self.lock:
+                delay = self.renewal - time.monotonic()
+            try:
+                await asyncio.wait_for(self.async_renew.wait(), max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+            self.async_renew.clear()
+
+            try:
+                try:
+                    await self.async_refresh(engine)
+                except aiohttp.ClientResponseError as e:
+                    if e.status not in (400, 401, 403):
+                        raise
+
+                    # The refresh token is not valid anymore, a new one is received logging in again.
+                    LOG.warning('The refresh token was rejected by the cloud: %s', e)
+                    await self.async_login(engine)
+                failures = 0
+                METRICS.inc('relayr_token_renewals_total', labels=(('result', 'ok'),))
+            except Exception as e:
+                METRICS.inc('relayr_token_renewals_total', labels=(('result', 'error'),))
+                failures += 1
+                delay = backoff(failures)
+                LOG.error('Error renewing the access token, retrying in %.1fs: %s', delay, e)
+                with self.lock:
+                    self.renewal = time.monotonic() + delay
+
+
+class BlockedError(RuntimeError):
+    """ The exception is raised by the limiter for the requests which cannot be sent now, because the cloud asked to
+        wait or the endpoint is failing. The requests can be tried again after the delay.
+    """
+    def __init__(self, endpoint, delay):
+        RuntimeError.__init__(self, 'The requests to ' + endpoint + ' are paused for ' + str(round(delay, 1)) + 's')
+        self.delay = delay
+
+
+class LimiterClass:
+    """ The class limits the requests to the cloud of all the jobs of the process. A token bucket lets through at most
+        RATE_LIMIT requests per second, with bursts of RATE_BURST requests. After an answer 429 all the requests wait
+        for the time in its Retry-After header, while after an answer 5xx or a connection error only the requests to
+        the same endpoint back off. After BREAKER_FAILURES consecutive failures the circuit of the endpoint opens: its
+        requests fail at once for BREAKER_TIME seconds, then a single request tests if the endpoint works again.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = RATE_BURST
+        self.updated = time.monotonic()
+
+        # The time until which all the requests wait, and the consecutive answers 429 received.
+        self.paused = 0
+        self.throttles = 0
+
+        # The consecutive failures of every endpoint and the time until which its requests wait.
+        self.failures = {}
+        self.blocked = {}
+
+    def endpoint(self, url):
+        """ The function returns the endpoint of a url, without the ids of the groups, of the devices and of the models
+        :param url: str
+        :return: str, for example 'devices/raw-measurements'
+        """
+        parts = urllib.parse.urlsplit(url).path.split('/')
+        return '/'.join(parts[1:2] + parts[3::2])
+
+    def remaining(self, endpoint):
+        """ The function returns the time to wait before a request to an endpoint can be sent
+        :param endpoint: str
+        :return: float, seconds
+        """
+        with self.lock:
+            return max(max(self.paused, self.blocked.get(endpoint, 0)) - time.monotonic(), 0)
+
+    def acquire(self, endpoint):
+        """ The function reserves the sending of a request to an endpoint
+        :param endpoint: str
+        :return: float, seconds to wait before sending the request
+        """
+        with self.lock:
+            now = time.monotonic()
+
+            blocked = max(self.paused, self.blocked.get(endpoint, 0)) - now
+            if blocked > 0:
+                raise BlockedError(endpoint, blocked + random.uniform(0, BACKOFF_BASE))
+
+            # Once the circuit is open, the first request tests the endpoint and the others wait for its answer.
+            if self.failures.get(endpoint, 0) >= BREAKER_FAILURES:
+                self.blocked[endpoint] = now + BREAKER_TIME
+
+            if RATE_LIMIT == 0:
+                return 0
+
+            # The bucket fills up with the time passed, the missing tokens are the wait of the requests reserved.
+            self.tokens = min(self.tokens + (now - self.updated) * RATE_LIMIT, RATE_BURST)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / RATE_LIMIT, 0)
+
+    def answered(self, endpoint, status, retry_after):
+        """ The function records the answer of an endpoint
+        :param endpoint: str
+        :param status: int, the HTTP status, None if the connection failed
+        :param retry_after: str, the Retry-After header, None if missing
+        :return: None
+        """
+        METRICS.inc('relayr_cloud_requests_total', labels=(('endpoint', endpoint),
+                                                           ('status', str(status) if status is not None else 'error')))
+        if status is None:
+            self.failed(endpoint)
+        elif status == 429:
+            self.throttled(parse_retry_after(retry_after))
+        elif status >= 500:
+            self.failed(endpoint, parse_retry_after(retry_after))
+        else:
+            with self.lock:
+                self.throttles = 0
+                self.failures.pop(endpoint, None)
+                self.blocked.pop(endpoint, None)
+
+    def throttled(self, retry_after):
+        """ The function pauses all the requests after an answer 429
+        :param retry_after: float, the seconds asked by the cloud, None to back off
+        :return: None
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.throttles += 1
+            delay = retry_after if retry_after is not None else backoff(self.throttles)
+            paused = self.paused > now
+            self.paused = max(self.paused, now + delay)
+
+        if not paused:
+            LOG.warning('Too many requests to the cloud: all the requests are paused for %.1fs', delay)
+
+    def failed(self, endpoint, retry_after=None):
+        """ The function backs off the requests to an endpoint after a failure
+        :param endpoint: str
+        :param retry_after: float, the seconds asked by the cloud, None to back off
+        :return: None
+        """
+        with self.lock:
+            failures = self.failures.get(endpoint, 0) + 1
+            self.failures[endpoint] = failures
+            delay = retry_after if retry_after is not None else backoff(failures)
+
+            # Too many consecutive failures open the circuit.
+            if failures >= BREAKER_FAILURES:
+                delay = max(delay, BREAKER_TIME)
+            self.blocked[endpoint] = max(self.blocked.get(endpoint, 0), time.monotonic() + delay)
+
+        if failures == BREAKER_FAILURES:
+            LOG.error('The requests to %s failed %d times: they are paused for %.1fs', endpoint, failures, delay)
+
+
+class SchedulerClass:
+    """ The class keeps a priority queue of poll jobs ordered by the time when they are due and runs them on a fixed
+        pool of worker threads, so the number of threads does not grow with the number of measurements. The due jobs
+        run from the one most behind, and at most CATCHUP_WORKERS jobs catching up a backlog run at the same time, so
+        the other workers keep polling the measurements which are up to date.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+
+        # The due jobs ordered by how much they are behind, the ones catching up apart, and how many of those run.
+        self.ready = []
+        self.catchup = []
+        self.catching_up = 0
+
+    def start(self):
+        """ The function starts the worker threads.
+        :return: None
+        """
+        # The workers waiting for a job are woken up when the script is stopping.
+        SHUTDOWN.add(self.wake)
+
+        for i in range(self.workers):
+            thread_tmp = threading.Thread(target=self.work, name='worker-' + str(i), daemon=True)
+            self.threads.append(thread_tmp)
+            thread_tmp.start()
+
+    def wake(self):
+        """ The function wakes up the workers waiting for a job
+        :return: None
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def join(self, timeout):
+        """ The function waits until the workers complete their running jobs once the script is stopping
+        :param timeout: float, seconds
+        :return: None
+        """
+        deadline = time.monotonic() + timeout
+        for thread_tmp in self.threads:
+            thread_tmp.join(max(deadline - time.monotonic(), 0))
+
+    def schedule(self, job, delay):
+        """ The function puts a job in the queue to be run after the given delay
+        :param job: object with the request() and process() methods
+        :param delay: float, seconds
+        :return: None
+        """
+        with self.condition:
+            # The counter breaks the ties between jobs due at the same time.
+            heapq.heappush(self.queue, (time.time() + delay, next(self.counter), job))
+            self.condition.notify()
+
+    def next_job(self):
+        """ The function waits until a job is due and can run, and removes it from the queue
+        :return: tuple, the job, None when the script is stopping, and whether it is catching up
+        """
+        with self.condition:
+            while True:
+                if SHUTDOWN.is_set():
+                    return None, False
+
+                # The due jobs are ordered by how much they are behind when they become due.
+                now = time.time()
+                while len(self.queue) != 0 and self.queue[0][0] <= now:
+                    job = heapq.heappop(self.queue)[2]
+                    heapq.heappush(self.catchup if job.catching_up else self.ready,
+                                   (-job.lag(), next(self.counter), job))
+
+                # A job catching up runs first, since it is the most behind, unless too many are already running.
+                if len(self.catchup) != 0 and self.catching_up < CATCHUP_WORKERS and \
+                        (len(self.ready) == 0 or self.catchup[0] < self.ready[0]):
+                    self.catching_up += 1
+                    return heapq.heappop(self.catchup)[2], True
+                if len(self.ready) != 0:
+                    return heapq.heappop(self.ready)[2], False
+
+                # Sleep until the first job is due, until a new job is scheduled or until a job catching up ends.
+                self.condition.wait(self.queue[0][0] - now if len(self.queue) != 0 else None)
+
+    def done(self, catching_up):
+        """ The function lets another job catching up run when one ends
+        :param catching_up: bool, whether the job which ended was catching up
+        :return: None
+        """
+        if catching_up:
+            with self.condition:
+                self.catching_up -= 1
+                self.condition.notify()
+
+    def work(self):
+        """ The function runs the due jobs and puts them back in the queue, until the script is stopping.
+        :return: None
+        """
+        while True:
+            job, catching_up = self.next_job()
+            if job is None:
+                return
+            started = time.monotonic()
+            try:
+                request = job.request()
+
+                # A stopped job does not run again.
+                if request is None:
+                    continue
+                url, params = request
+
+                # The answer is parsed while it is received, so it is never kept whole in memory.
+                with cloud_get(url, params, stream=True) as raw_req:
+                    delay = job.process(iter_readings(raw_req.iter_content(CHUNK_SIZE)))
+                METRICS.observe('relayr_poll_duration_seconds', time.monotonic() - started)
+            except BlockedError as e:
+                # The job tries again once the requests can be sent.
+                delay = e.delay
+            except Exception as e:
+                LOG.error('Error polling %s: %s', job.name, e)
+                METRICS.inc('relayr_poll_errors_total')
+                delay = REFRESH
+            finally:
+                self.done(catching_up)
+
+            # A job returning None does not need to run again.
+            if delay is not None:
+                self.schedule(job, delay)
+
+
+class RawClass:
+    """ The class downloads the measurements of a device and saves them in influxdb. Every poll requests at once all
+        the measurements which are due, starting from the oldest of their last timestamps, and then splits the readings
+        by measurement. Every measurement is polled with its own interval, learnt from the time between its readings.
+    """
+    def __init__(self, writer, checkpoint, source, device, devname, measurements_names, tags, schema):
+        self.name = devname
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.source = source
+        self.device = device
+        self.measurements_names = measurements_names
+        self.tags = tags
+        self.schema = schema
+        self.buffer = BufferClass(writer, source['db'], tags, schema)
+
+        # The start timestamp provided via command line is used if it is present, otherwise the download continues
+        # from the stored last timestamps and starts from the default start only for the measurements never saved.
+        # The last timestamp of the readings written of every measurement is the index of the readings not to write
+        # again, since the readings of a measurement are received in order.
+        self.last_timestamps = dict.fromkeys(measurements_names, START)
+        self.written = {}
+        if RESUME:
+            self.restore(measurements_names)
+
+        # The measurements start with the refresh period as interval and are all due at the first poll.
+        self.intervals = dict.fromkeys(measurements_names, self.bound(source['refresh']))
+        self.gaps = {}
+        self.seen = set()
+        self.due = dict.fromkeys(measurements_names, 0)
+        self.requested = measurements_names
+
+        # Whether the last poll received a full page, so the measurements are polled again at once.
+        self.catching_up = False
+
+        # Changes requested while the job may be running, applied by the next poll.
+        self.stopped = False
+        self.changed_names = None
+        self.changed_schema = None
+
+        LOG.info('Scheduled download of the measurements: %s', ', '.join(measurements_names))
+
+    def legacy_keys(self, names):
+        """ The function returns the keys of the measurements in the shelve file of the versions before the SQLite
+            store: the device name and the measurement name for the groups, only the measurement name for a device.
+        :param names: list of str
+        :return: dict, the key of every measurement name
+        """
+        if self.source['tag']:
+            return {name: self.name + '-' + name for name in names}
+        return {name: name for name in names}
+
+    def restore(self, names):
+        """ The function reads the stored last timestamps of some measurements and of their written readings
+        :param names: list of str
+        :return: None
+        """
+        for name, (timestamp, written) in self.checkpoint.get(self.device, names, self.legacy_keys(names)).items():
+            self.last_timestamps[name] = timestamp
+            if written is not None:
+                self.written[name] = written
+
+    def lag(self):
+        """ The function returns how much the due measurements are behind, from the oldest of their last timestamps to
+            now, as they are chosen by request()
+        :return: float, seconds
+        """
+        now = time.time()
+        due = [self.last_timestamps[name] for name in self.measurements_names
+               if self.due[name] - now <= self.intervals[name] / 2]
+        return now - min(due) / 1000 if len(due) != 0 else 0
+
+    def bound(self, interval):
+        """ The function limits an interval between the minimum and the maximum refresh of the device
+        :param interval: float, seconds
+        :return: float
+        """
+        return min(max(interval, self.source['min_refresh']), self.source['max_refresh'])
+
+    def stop(self):
+        """ The function stops the job: the running poll is completed, the next one does not start.
+        :return: None
+        """
+        self.stopped = True
+
+    def change(self, measurements_names, schema):
+        """ The function changes the measurements to download and their encoders, starting from the next poll
+        :param measurements_names: list of str
+        :param schema: SchemaClass
+        :return: None
+        """
+        self.changed_schema = schema
+        self.changed_names = measurements_names
+
+    def apply_change(self):
+        """ The function adds the new measurements to download and removes the old ones, keeping the state of the
+            measurements not changed.
+        :return: None
+        """
+        measurements_names = self.changed_names
+        self.changed_names = None
+        self.schema = self.changed_schema
+        self.buffer.set_schema(self.schema)
+
+        added = [name for name in measurements_names if name not in self.last_timestamps]
+        for name in added:
+            self.last_timestamps[name] = START
+            self.intervals[name] = self.bound(self.source['refresh'])
+            self.due[name] = 0
+        if RESUME:
+            self.restore(added)
+
+        for name in self.measurements_names:
+            if name not in measurements_names:
+                for state in (self.last_timestamps, self.written, self.intervals, self.due, self.gaps):
+                    state.pop(name, None)
+                self.seen.discard(name)
+
+        self.measurements_names = measurements_names
+        LOG.info('Measurements to download for %s: %s', self.name, ', '.join(measurements_names))
+
+    def request(self):
+        """ The function prepares the request of the new readings of the measurements of the device which are due
+        :return: tuple, the url and the query parameters, None if the job is stopped
+        """
+        if self.stopped:
+            return None
+        if self.changed_names is not None:
+            self.apply_change()
+
+        now = time.time()
+
+        # A measurement due within half of its interval is requested in advance together with the due ones.
+        due = [name for name in self.measurements_names if self.due[name] - now <= self.intervals[name] / 2]
+
+        # Only the measurements whose last timestamps are close to the one of the most overdue measurement are
+        # requested together, so a measurement without readings for a long time does not make the others download
+        # again all their readings since then. The other due measurements are requested by the next polls.
+        first = self.last_timestamps[min(due, key=lambda name: self.due[name])]
+        self.requested = [name for name in due if abs(self.last_timestamps[name] - first) <= MERGE_WINDOW * 1000]
+
+        # The request starts from the oldest timestamp, the readings already downloaded are skipped in process(). A
+        # full page tells that the cloud has more readings.
+        params = {'start': format_timestamp(min([self.last_timestamps[name] for name in self.requested])),
+                  'limit': PAGE_LIMIT}
+
+        # Without the special character and the shards all the measurements are downloaded, so the filter is needed
+        # only if some measurements are not due.
+        if self.source['special_char'] is not None or RING is not None or PROCESS is not None or \
+                len(self.requested) != len(self.measurements_names):
+            params['measurements'] = ','.join(self.requested)
+
+        return CLOUD_URL + '/devices/' + self.device + '/raw-measurements', params
+
+    def process(self, readings):
+        """ The function saves in influxdb the readings received from the cloud
+        :param readings: iterable of dict, the readings as received from the cloud
+        :return: float, seconds to wait before the next poll
+        """
+        cursors = {}
+        written = {}
+        for name in self.requested:
+            cursors[name] = self.last_timestamps[name]
+            written[name] = self.written.get(name, -1)
+
+        last_timestamps = {}
+        first_timestamps = {}
+        counts = dict.fromkeys(self.requested, 0)
+        duplicates = 0
+        received = 0
+
+        # Cycle all the measurements and encode the new readings.
+        try:
+            for reading in readings:
+                received += 1
+                name = reading['name']
+                timestamp = parse_timestamp(reading['timestamp'])
+
+                # Skip the measurements not to download and the readings older than the last timestamp of the
+                # measurement.
+                if name not in cursors or timestamp < cursors[name]:
+                    continue
+
+                # The readings already written, received again since the last timestamp is included in the request,
+                # or after the stored last timestamp was moved back, are not written again but only aggregated in the
+                # rollups.
+                new = timestamp > written[name]
+                if not new:
+                    duplicates += 1
+                    if self.buffer.rollup is None:
+                        continue
+
+                # A reading which cannot be encoded is skipped, but the last timestamp moves after it as well.
+                if self.buffer.add(reading, timestamp, new) and new:
+                    counts[name] += 1
+                    if name not in first_timestamps:
+                        first_timestamps[name] = timestamp
+
+                # Update the last timestamp of the measurement every time the cycle has readings. The next poll starts
+                # from it, included, so no reading after it is missed; the readings received later with the timestamp
+                # of the last reading written are skipped, since a measurement keeps only its first reading of every
+                # millisecond.
+                last_timestamps[name] = timestamp
+
+                # Pass the readings to the writer as soon as the buffer is full, with the last timestamps reached so
+                # far.
+                if self.buffer.points >= BATCH_SIZE:
+                    self.save(last_timestamps)
+        except Exception:
+            # The readings encoded by the failed poll are dropped, the next poll downloads them again.
+            self.buffer.clear()
+            raise
+
+        if duplicates != 0:
+            METRICS.inc('relayr_duplicate_readings_total', duplicates)
+
+        now = time.time()
+
+        # The windows of the rollups ended before the poll are closed, and the last timestamps of their measurements
+        # are saved again, since they are no longer kept at the start of the windows.
+        if self.buffer.rollup is not None:
+            for name in self.buffer.rollup.close(int((now - ROLLUP_DELAY) * 1000)):
+                if name in self.last_timestamps and name not in last_timestamps:
+                    last_timestamps[name] = self.last_timestamps[name]
+
+        # If new data are received, the writer saves the last timestamps once the readings are written.
+        if len(last_timestamps) != 0:
+            self.save(last_timestamps)
+
+        # A full page means that the cloud has more readings: the measurements are polled again at once, as long as
+        # the start of the request moves forward, until they catch up.
+        self.catching_up = received >= PAGE_LIMIT and \
+            min(self.last_timestamps[name] for name in self.requested) > min(cursors.values())
+
+        for name in self.requested:
+
+            # The time between the readings is estimated from the readings received, including the previous reading
+            # when the measurement already had readings, and it is averaged with the previous estimates.
+            if counts[name] != 0:
+                gap = None
+                if name in self.seen:
+                    gap = (last_timestamps[name] - cursors[name]) / counts[name] / 1000
+                elif counts[name] > 1:
+                    gap = (last_timestamps[name] - first_timestamps[name]) / (counts[name] - 1) / 1000
+                self.seen.add(name)
+
+                if gap is not None:
+                    self.gaps[name] = (self.gaps[name] + gap) / 2 if name in self.gaps else gap
+                    self.intervals[name] = self.bound(self.gaps[name])
+
+            # Without new readings the measurement is polled less often, unless its readings did not fit in the page.
+            elif not self.catching_up:
+                self.intervals[name] = self.bound(self.intervals[name] * 2)
+
+            # The jitter avoids that the polls of all the measurements happen at the same time.
+            self.due[name] = now if self.catching_up else \
+                now + self.intervals[name] * random.uniform(1 - JITTER, 1 + JITTER)
+
+        if self.catching_up:
+            METRICS.inc('relayr_catchup_polls_total')
+
+        # Wait until the first measurement is due.
+        return max(min(self.due.values()) - now, 0)
+
+    def save(self, last_timestamps):
+        """ The function passes the encoded readings to the writer and moves the last timestamps of the measurements
+            and of their written readings to them
+        :param last_timestamps: dict, the last timestamp in milliseconds of every measurement name
+        :return: None
+        """
+        for name in last_timestamps:
+            self.written[name] = max(self.written.get(name, -1), last_timestamps[name])
+
+        self.buffer.flush(self.cursors(last_timestamps))
+        self.last_timestamps.update(last_timestamps)
+
+    def cursors(self, last_timestamps):
+        """ The function converts the last timestamps of the measurements in the rows saved in the checkpoint store.
+            With the rollups, the saved timestamp does not pass the start of the open windows of the measurement, so
+            after a restart their readings are downloaded again and the windows are aggregated whole.
+        :param last_timestamps: dict, the last timestamp in milliseconds of every measurement name
+        :return: list of tuples, the device id, the measurement name, the timestamp and the timestamp of the last
+            reading written in milliseconds
+        """
+        cursors = []
+        for name in last_timestamps:
+            timestamp = last_timestamps[name]
+            if self.buffer.rollup is not None and self.buffer.rollup.start(name) is not None:
+                timestamp = min(timestamp, self.buffer.rollup.start(name))
+            cursors.append((self.device, name, timestamp, self.written[name]))
+        return cursors
+
+
+class SchemaClass:
+    """ The class chooses once the encoder of every measurement of a device model from the type of the measurement in
+        the model, so that encoding a reading is a lookup: the numbers, the integers, the booleans and the strings are
+        encoded in the field value with their type, the objects and the arrays in one field for every value they
+        contain. The measurements without a known type are encoded with the type of their values. With FIELD_TYPES
+        'float' all the values are encoded as floats, as by the versions before, since InfluxDB refuses the values of a
+        field with a type different from the one already written.
+    """
+    # The encoders of the types of the measurements in the models.
+    ENCODERS = {'number': functools.partial(value_fields, float_value),
+                'integer': functools.partial(value_fields, integer_value),
+                'boolean': functools.partial(value_fields, boolean_value),
+                'string': functools.partial(value_fields, string_value),
+                'object': object_fields,
+                'array': object_fields}
+
+    def __init__(self, model_req_json):
+        self.encoders = {}
+        for measurement in model_req_json['measurements']:
+            self.encoders[measurement['name']] = self.encoder(measurement.get('type'))
+
+    def encoder(self, kind):
+        """ The function returns the encoder of a type of measurement
+        :param kind: str, the type in the model, None if it is unknown
+        :return: function, encoding a value in the fields of line protocol
+        """
+        if FIELD_TYPES == 'float':
+            return self.ENCODERS['number']
+        if isinstance(kind, str) and kind in self.ENCODERS:
+            return self.ENCODERS[kind]
+        return any_fields
+
+    def get(self, name):
+        """ The function returns the encoder of a measurement
+        :param name: str, the measurement name
+        :return: function, encoding a value in the fields of line protocol
+        """
+        if name in self.encoders:
+            return self.encoders[name]
+        return self.encoder(None)
+
+
+class BufferClass:
+    """ The class encodes readings with line protocol in a buffer, which is passed to the writer and emptied every
+        BATCH_SIZE points, so the memory used does not depend on the number of readings received.
+    """
+    def __init__(self, writer, db, tags, schema):
+        self.writer = writer
+        self.db = db
+        self.tags = tags
+        self.schema = schema
+        self.buffer = bytearray()
+        self.points = 0
+
+        # The tags and the names of the measurements are escaped only once, and the encoder of every measurement is
+        # looked up only once.
+        self.tag_set = ''.join(',' + escape(key, ',= ') + '=' + escape(tags[key], ',= ')
+                               for key in sorted(tags)).encode('utf-8')
+        self.measurements = {}
+
+        # The readings are aggregated in the rollups while they are encoded.
+        self.rollup = RollupClass() if len(ROLLUPS) != 0 else None
+
+        # Logging every reading is expensive, so it is checked only once.
+        self.debug = LOG.isEnabledFor(logging.DEBUG)
+
+    def set_schema(self, schema):
+        """ The function changes the encoders of the measurements
+        :param schema: SchemaClass
+        :return: None
+        """
+        self.schema = schema
+        self.measurements = {}
+
+    def add(self, reading, timestamp, write=True):
+        """ The function encodes a reading at the end of the buffer
+        :param reading: dict, the reading as received from the cloud
+        :param timestamp: int, the timestamp of the reading in milliseconds
+        :param write: bool, False to aggregate in the rollups a reading already written, without writing it again
+        :return: bool, False if the reading cannot be encoded and is skipped
+        """
+        name = reading['name']
+
+        if name not in self.measurements:
+            self.measurements[name] = (escape(name, ', ').encode('utf-8') + self.tag_set + b' ', self.schema.get(name))
+        prefix, encode = self.measurements[name]
+        value = reading.get('value')
+
+        if not write:
+            return self.rollup is not None and self.rollup.add(prefix, name, value, timestamp)
+
+        # The readings whose values do not match the type of the measurement are skipped, and with only the rollups
+        # the readings which are not numbers.
+        if ROLLUPS_ONLY:
+            encoded = self.rollup.add(prefix, name, value, timestamp)
+        else:
+            fields = encode(value)
+            encoded = fields is not None
+            if encoded:
+                self.buffer += prefix
+                self.buffer += fields
+                self.buffer += b' %d\n' % timestamp
+                self.points += 1
+                if self.rollup is not None:
+                    self.rollup.add(prefix, name, value, timestamp)
+
+        if not encoded:
+            LOG.warning('Skipped the reading of %s at %s with value %r', name, reading['timestamp'], value)
+            METRICS.inc('relayr_skipped_readings_total')
+            return False
+
+        if self.debug:
+            LOG.debug('%s', ' - '.join([reading['timestamp']] + list(self.tags.values()) +
+                                       [name, str(value)]))
+        return True
+
+    def clear(self):
+        """ The function empties the buffer without passing the encoded readings to the writer. The rollups are kept,
+            since they ignore the readings downloaded again.
+        :return: None
+        """
+        del self.buffer[:]
+        self.points = 0
+
+    def flush(self, cursors=()):
+        """ The function passes the encoded readings and the closed windows of the rollups to the writer and empties
+            the buffer
+        :param cursors: list of tuples, the last timestamps to save once the readings are written
+        :return: None
+        """
+        if self.rollup is not None:
+            self.rollup.flush(self.writer, self.db)
+
+        # The last timestamps are passed also without readings, when all the readings received are skipped.
+        if self.points != 0 or len(cursors) != 0:
+            METRICS.inc('relayr_readings_total', self.points)
+            self.writer.put(self.db, bytes(self.buffer), self.points, cursors)
+            del self.buffer[:]
+            self.points = 0
+
+
+class RollupClass:
+    """ The class aggregates the numeric readings of the measurements of a device in the windows of every rollup of
+        ROLLUPS while they are encoded: the open window of every measurement keeps the minimum, the maximum, the sum,
+        the count and the last value. A window is closed by the first reading of a later window, or by the time once it
+        ended, and it is encoded in a point at its start in the retention policy of its rollup, with the fields min,
+        max, mean, count and last. The windows start at multiples of their size since the epoch, so the points of a
+        window are the same whichever process downloads it.
+    """
+    def __init__(self):
+        self.sizes = {rp: window for window, rp, duration in ROLLUPS}
+        self.longest = ROLLUPS[-1][1]
+
+        # The open windows and the end of the last closed window of every retention policy and measurement.
+        self.windows = {}
+        self.ends = {}
+
+        # The points of the closed windows of every retention policy.
+        self.buffers = {rp: bytearray() for rp in self.sizes}
+        self.points = dict.fromkeys(self.sizes, 0)
+
+    def add(self, prefix, name, value, timestamp):
+        """ The function aggregates a reading in the windows of the rollups
+        :param prefix: bytes, the measurement name and the tags encoded with line protocol
+        :param name: str, the measurement name
+        :param value: the value of the reading
+        :param timestamp: int, the timestamp of the reading in milliseconds
+        :return: bool, False if the value is not a number
+        """
+        if isinstance(value, bool):
+            return False
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        if not math.isfinite(value):
+            return False
+
+        for rp, size in self.sizes.items():
+            key = (rp, name)
+            start = timestamp - timestamp % size
+            window = self.windows.get(key)
+
+            # The readings of the closed windows, and the ones already aggregated when they are downloaded again after
+            # a failed poll, are ignored.
+            if start < self.ends.get(key, 0):
+                continue
+
+            if window is None or start > window[0]:
+                if window is not None:
+                    self.encode(key, window)
+                self.windows[key] = [start, value, value, value, 1, value, timestamp, prefix]
+            elif timestamp > window[6]:
+                window[1] = min(window[1], value)
+                window[2] = max(window[2], value)
+                window[3] += value
+                window[4] += 1
+                window[5] = value
+                window[6] = timestamp
+
+        return True
+
+    def encode(self, key, window):
+        """ The function closes a window and encodes it in a point
+        :param key: tuple, the retention policy and the measurement name
+        :param window: list, the start, the minimum, the maximum, the sum, the count, the last value and its timestamp,
+            and the prefix of the points of the measurement
+        :return: None
+        """
+        start, low, high, total, count, last, timestamp, prefix = window
+        self.buffers[key[0]] += prefix + b'min=%r,max=%r,mean=%r,count=%di,last=%r %d\n' % (
+            low, high, total / count, count, last, start)
+        self.points[key[0]] += 1
+        self.ends[key] = start + self.sizes[key[0]]
+
+    def close(self, before=None):
+        """ The function closes the windows which ended before a time
+        :param before: int, milliseconds since the epoch, None to close all the windows
+        :return: set of str, the names of the measurements whose windows are closed
+        """
+        names = set()
+        for key, window in list(self.windows.items()):
+            if before is None or window[0] + self.sizes[key[0]] <= before:
+                self.encode(key, self.windows.pop(key))
+                names.add(key[1])
+        return names
+
+    def start(self, name):
+        """ The function returns the start of the open window of the longest rollup of a measurement, which is the
+            oldest of the open windows of the measurement since the windows of the shorter rollups are within it
+        :param name: str, the measurement name
+        :return: int, milliseconds since the epoch, None if the measurement has no open window
+        """
+        window = self.windows.get((self.longest, name))
+        return window[0] if window is not None else None
+
+    def flush(self, writer, db):
+        """ The function passes the points of the closed windows to the writer
+        :param writer: WriterClass or ProcessWriterClass
+        :param db: str, the database of the points
+        :return: None
+        """
+        for rp in self.buffers:
+            if self.points[rp] != 0:
+                METRICS.inc('relayr_rollup_points_total', self.points[rp])
+                writer.put(db, bytes(self.buffers[rp]), self.points[rp], [], rp)
+                del self.buffers[rp][:]
+                self.points[rp] = 0
+
+
+class InfluxSinkClass:
+    """ The class writes the points in influxdb with line protocol over HTTP, compressed with gzip if requested. It
+        waits until influxdb is available to create the databases and the retention policies of the rollups.
+    """
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.influxClient = None
+
+    def connect(self, dbs):
+        """ The function connects to influxdb and creates the databases, retrying until influxdb is available
+        :param dbs: list of str, the databases of the points
+        :return: None
+        """
+        # Cycle until it is established the connection to the local instance of InfluxDB.
+        while True:
+            try:
+                LOG.info('Connecting to InfluxDB...')
+                self.influxClient = InfluxDBClient(INFLUXDB_ADDRESS, INFLUXDB_PORT, "root", "root")
+
+                # If the databases already exist, the creation is skipped.
+                for db in dbs:
+                    self.influxClient.create_database(db)
+                    for window, rp, duration in ROLLUPS:
+                        create_retention_policy(self.influxClient, db, rp, duration)
+
+                LOG.info("Connection to InfluxDB established")
+                break
+            except:
+                LOG.warning("InfluxDB not ready: retrying...")
+                if SHUTDOWN.wait(5):
+                    return
+
+    def write(self, db, data, rp=None):
+        """ The function writes points in influxdb
+        :param db: str, the database of the points
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, None for the default one of the database
+        :return: None
+        """
+        write_lines(self.influxClient, db, data, rp, self.compress)
+
+    def retryable(self, error):
+        """ The function tells if a write failed because influxdb is not available, so it can be retried
+        :param error: Exception
+        :return: bool
+        """
+        return is_retryable(error)
+
+
+class UdpSinkClass:
+    """ The class sends the points to the UDP listener of influxdb, in datagrams of at most UDP_PAYLOAD bytes. The
+        sends do not wait for influxdb, but influxdb does not confirm them: the points lost on the way, or refused, are
+        not noticed. The UDP listener writes all the points in its own database and retention policy, and it reads the
+        timestamps in nanoseconds unless it is configured otherwise.
+    """
+    def __init__(self):
+        self.address = (INFLUXDB_ADDRESS, UDP_PORT)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def connect(self, dbs):
+        """ The function checks the databases of the points, since they cannot be chosen over UDP
+        :param dbs: list of str, the databases of the points
+        :return: None
+        """
+        if len(dbs) > 1:
+            LOG.warning('The points of the databases %s are all written in the database of the UDP listener',
+                        ', '.join(dbs))
+        LOG.info('Sending the points to the UDP listener of InfluxDB at %s:%d', *self.address)
+
+    def write(self, db, data, rp=None):
+        """ The function sends points to influxdb
+        :param db: str, the database of the points, ignored
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, ignored
+        :return: None
+        """
+        # Every line ends with its timestamp in milliseconds, which becomes nanoseconds.
+        data = data.replace(b'\n', b'000000\n')
+
+        # The datagrams are cut at the end of the lines, a line longer than a datagram is sent alone.
+        start = 0
+        while start < len(data):
+            end = data.rfind(b'\n', start, start + UDP_PAYLOAD) + 1
+            if end <= start:
+                end = data.index(b'\n', start) + 1
+            self.socket.sendto(data[start:end], self.address)
+            start = end
+
+    def retryable(self, error):
+        """ The function tells if a send failed for a reason which can go away, so it can be retried
+        :param error: Exception
+        :return: bool
+        """
+        return not isinstance(error, OSError) or error.errno != errno.EMSGSIZE
+
+
+class FileSinkClass:
+    """ The class is the base of the sinks writing the points in local files, mainly to test the script or to analyse
+        the readings without influxdb. The points are decoded in one row for every field, with the timestamp in
+        milliseconds, the measurement, the tag set as in line protocol, the name and the value of the field.
+    """
+    def connect(self, dbs):
+        """ The function creates the folder of the files
+        :param dbs: list of str, the databases of the points
+        :return: None
+        """
+        os.makedirs(SINK_PATH, exist_ok=True)
+        LOG.info('Writing the points in %s', SINK_PATH)
+
+    def folder(self, db, rp):
+        """ The function returns the folder of the files of a database and retention policy
+        :param db: str
+        :param rp: str, None for the default one
+        :return: str
+        """
+        return os.path.join(SINK_PATH, db if rp is None else db + '.' + rp)
+
+    def period(self):
+        """ The function returns the name of the current period of SINK_ROTATE seconds, after which a new file is used
+        :return: str
+        """
+        now = int(time.time())
+        return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now - now % SINK_ROTATE))
+
+    def retryable(self, error):
+        """ The function tells if a write failed for a reason which can go away, for example a full disk, so it can be
+            retried, or because the points cannot be decoded
+        :param error: Exception
+        :return: bool
+        """
+        return isinstance(error, (OSError, sqlite3.OperationalError))
+
+
+class ParquetSinkClass(FileSinkClass):
+    """ The class extends the FileSinkClass class. It writes every batch of points in its own Parquet file, in a folder
+        for every period of SINK_ROTATE seconds, so that no file is left without its footer by a crash. Once a period
+        ends, its files are merged in one file with large row groups. The values have a column for every type, and
+        only the one of their type is filled.
+    """
+    def __init__(self):
+        if pyarrow is None:
+            raise RuntimeError('The parquet sink requires the pyarrow module: pip install pyarrow')
+
+        self.schema = pyarrow.schema([('time', pyarrow.timestamp('ms', tz='UTC')), ('measurement', pyarrow.string()),
+                                      ('tags', pyarrow.string()), ('field', pyarrow.string()),
+                                      ('float', pyarrow.float64()), ('integer', pyarrow.int64()),
+                                      ('boolean', pyarrow.bool_()), ('string', pyarrow.string())])
+        self.lock = threading.Lock()
+        self.files = itertools.count()
+
+        # The current period of every folder, whose ended periods are merged when it changes.
+        self.periods = {}
+
+    def merge(self, folder, period):
+        """ The function merges the files of every period of a folder ended before the current one, also of the periods
+            ended while the script was not running
+        :param folder: str, the folder of a database and retention policy
+        :param period: str, the current period
+        :return: None
+        """
+        for ended in sorted(os.listdir(folder)):
+            if ended >= period or not os.path.isdir(os.path.join(folder, ended)):
+                continue
+            try:
+                self.merge_files(os.path.join(folder, ended))
+            except Exception as e:
+                # The files are left as they are and merged at the next change of the period.
+                LOG.error('Error merging the Parquet files in %s: %s', os.path.join(folder, ended), e)
+
+    def merge_files(self, folder):
+        """ The function merges the files of a period in one file, reading them one at a time. The merged file
+            replaces the first file and then the other files are deleted, so a crash in between only writes their
+            points again at the next merge.
+        :param folder: str, the folder of a period
+        :return: None
+        """
+        names = sorted(name for name in os.listdir(folder) if name.endswith('.parquet') and not name.startswith('.'))
+        if len(names) < 2:
+            return
+
+        merged = os.path.join(folder, '.merged.parquet')
+        tables = []
+        rows = 0
+        with pyarrow.parquet.ParquetWriter(merged, self.schema) as writer:
+            for name in names:
+                tables.append(pyarrow.parquet.read_table(os.path.join(folder, name), schema=self.schema))
+                rows += tables[-1].num_rows
+                if rows >= PARQUET_ROW_GROUP:
+                    writer.write_table(pyarrow.concat_tables(tables))
+                    tables = []
+                    rows = 0
+            if len(tables) != 0:
+                writer.write_table(pyarrow.concat_tables(tables))
+
+        os.replace(merged, os.path.join(folder, names[0]))
+        for name in names[1:]:
+            os.remove(os.path.join(folder, name))
+        LOG.info('Merged %d Parquet files in %s', len(names), os.path.join(folder, names[0]))
+
+    def write(self, db, data, rp=None):
+        """ The function writes points in a new Parquet file
+        :param db: str, the database of the points
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, None for the default one
+        :return: None
+        """
+        columns = {name: [] for name in self.schema.names}
+        for row in decode_points(data):
+            for name, value in zip(('time', 'measurement', 'tags', 'field'), row):
+                columns[name].append(value)
+            for name, kind in (('float', float), ('integer', int), ('boolean', bool), ('string', str)):
+                columns[name].append(row[4] if type(row[4]) is kind else None)
+
+        period = self.period()
+        folder = os.path.join(self.folder(db, rp), period)
+        os.makedirs(folder, exist_ok=True)
+        with self.lock:
+            name = '%d-%d.parquet' % (time.time() * 1000, next(self.files))
+
+            # The first write of a new period merges the files of the periods ended. The writer and the spool write
+            # with the same sink, so they merge one at a time.
+            if self.periods.get(self.folder(db, rp)) != period:
+                self.merge(self.folder(db, rp), period)
+                self.periods[self.folder(db, rp)] = period
+
+        # The file appears only once it is complete, the readers of Parquet datasets skip the hidden files.
+        pyarrow.parquet.write_table(pyarrow.table(columns, schema=self.schema), os.path.join(folder, '.' + name))
+        os.replace(os.path.join(folder, '.' + name), os.path.join(folder, name))
+
+
+class CsvSinkClass(FileSinkClass):
+    """ The class extends the FileSinkClass class. It appends the points to a CSV file for every period of SINK_ROTATE
+        seconds, and waits until they are on disk.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def write(self, db, data, rp=None):
+        """ The function appends points to the current CSV file
+        :param db: str, the database of the points
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, None for the default one
+        :return: None
+        """
+        rows = list(decode_points(data))
+        folder = self.folder(db, rp)
+        os.makedirs(folder, exist_ok=True)
+
+        with self.lock:
+            with open(os.path.join(folder, self.period() + '.csv'), 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if f.tell() == 0:
+                    writer.writerow(('time', 'measurement', 'tags', 'field', 'value'))
+                writer.writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class SqliteSinkClass(FileSinkClass):
+    """ The class extends the FileSinkClass class. It writes the points in a table of a SQLite database, where a point
+        written again replaces the one with the same time, measurement, tags and field, as in influxdb.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self, dbs):
+        """ The function opens the database and creates the table of the points
+        :param dbs: list of str, the databases of the points
+        :return: None
+        """
+        folder = os.path.dirname(SINK_PATH)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(SINK_PATH, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS points (db TEXT NOT NULL, rp TEXT NOT NULL, '
+                                'measurement TEXT NOT NULL, tags TEXT NOT NULL, field TEXT NOT NULL, '
+                                'time INTEGER NOT NULL, value, '
+                                'PRIMARY KEY (db, rp, measurement, tags, field, time)) WITHOUT ROWID')
+        self.connection.commit()
+        LOG.info('Writing the points in %s', SINK_PATH)
+
+    def write(self, db, data, rp=None):
+        """ The function writes points in the table in one transaction
+        :param db: str, the database of the points
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, None for the default one, stored as an empty string
+        :return: None
+        """
+        rows = [(db, rp or '', measurement, tags, field, timestamp, value)
+                for timestamp, measurement, tags, field, value in decode_points(data)]
+
+        with self.lock:
+            try:
+                self.connection.executemany('INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self.connection.commit()
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+
+
+class WriterClass(threading.Thread):
+    """ The class extends the Thread class. It collects the points of all the poll jobs and writes them in the sink,
+        influxdb by default, with line protocol, in one write for every database every BATCH_SIZE points or BATCH_TIME
+        milliseconds after the first point collected. Then it saves the last timestamps of the written points. When
+        the sink is slower than the downloads, the queue fills up and the poll jobs wait to add their points. The
+        points which cannot be written are saved in the spool, and the last timestamps are saved only once the points
+        are either in the sink or in the spool.
+    """
+    def __init__(self, sink, checkpoint, spool, shared_queue=None):
+        threading.Thread.__init__(self)
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.spool = spool
+
+        # With more processes, the points come from the queue shared with the processes.
+        self.queue = shared_queue if shared_queue is not None else queue.Queue(maxsize=QUEUE_SIZE)
+
+        # The last timestamps which could not be saved are saved with the next ones.
+        self.unsaved = []
+
+    def put(self, db, lines, points, cursors, rp=None):
+        """ The function adds points to the queue, waiting if it is full
+        :param db: str, the database of the points
+        :param lines: bytes, the points encoded with line protocol by the thread of the poll job
+        :param points: int, the number of points
+        :param cursors: list of tuples, the last timestamps to save once the points are written
+        :param rp: str, the retention policy of the points, None for the default one of the database
+        :return: None
+        """
+        self.queue.put((db, rp, lines, points, cursors))
+
+    def stop(self):
+        """ The function asks the writer to write the points in the queue and to end, once nothing else is added to
+            the queue
+        :return: None
+        """
+        self.queue.put(None)
+
+    def run(self):
+        # The lines, the number of points and the last timestamps collected for every database and retention policy.
+        batches = {}
+        deadline = 0
+
+        while True:
+
+            # Wait for new points, but not longer than the time left before writing the collected ones.
+            try:
+                if len(batches) == 0:
+                    item = self.queue.get()
+                    deadline = time.time() + BATCH_TIME / 1000
+                else:
+                    item = self.queue.get(timeout=max(deadline - time.time(), 0))
+
+                # At the end of the queue the collected points are written at once, and the last timestamps not saved
+                # are tried again.
+                if item is None:
+                    for key in sorted(batches, key=lambda key: key[1] is None):
+                        self.flush(*key, *batches.pop(key))
+                    if len(self.unsaved) != 0:
+                        self.flush(None, None, [], 0, [])
+                    return
+                db, rp, lines, points, cursors = item
+
+                batch = batches.setdefault((db, rp), [[], 0, []])
+                batch[0].append(lines)
+                batch[1] += points
+                batch[2] += cursors
+
+                # Write the points of a database as soon as they are enough. The rollups are written together with the
+                # readings and before them, so the last timestamps are saved once the rollups are written as well.
+                if batch[1] >= BATCH_SIZE:
+                    for key in sorted([key for key in batches if key[0] == db], key=lambda key: key[1] is None):
+                        self.flush(*key, *batches.pop(key))
+            except queue.Empty:
+                pass
+
+            if len(batches) != 0 and time.time() >= deadline:
+                for key in sorted(batches, key=lambda key: key[1] is None):
+                    self.flush(*key, *batches.pop(key))
+
+    def flush(self, db, rp, lines, points, cursors):
+        """ The function writes the collected points in the sink and saves their last timestamps
+        :param db: str, the database of the points
+        :param rp: str, the retention policy of the points, None for the default one of the database
+        :param lines: list of bytes, the points encoded with line protocol
+        :param points: int, the number of points
+        :param cursors: list of tuples, the last timestamps of the points
+        :return: None
+        """
+        data = b''.join(lines)
+
+        # Without points, for example when only the rollups are written, only the last timestamps are saved.
+        if points != 0:
+            METRICS.observe('relayr_influxdb_batch_points', points, MetricsClass.SIZE_BUCKETS)
+            try:
+                # Save data in the sink.
+                started = time.monotonic()
+                self.sink.write(db, data, rp)
+                METRICS.observe('relayr_influxdb_write_duration_seconds', time.monotonic() - started)
+                METRICS.inc('relayr_influxdb_points_total', points)
+            except Exception as e:
+                LOG.error("Error writing %d points, saving them in the spool: %s", points, e)
+                METRICS.inc('relayr_influxdb_write_errors_total')
+                try:
+                    self.spool.append(db, data, rp)
+                    METRICS.inc('relayr_spooled_points_total', points)
+                except Exception as e:
+                    # The last timestamps are not saved, so the points are downloaded again after a restart.
+                    LOG.error("Error saving %d points in the spool: %s", points, e)
+                    return
+
+        # Save the last timestamps of all the written measurements in one transaction.
+        cursors = list({cursor[:2]: cursor for cursor in self.unsaved + cursors}.values())
+        if len(cursors) != 0:
+            try:
+                self.checkpoint.set(cursors)
+                self.unsaved = []
+            except sqlite3.Error as e:
+                LOG.error('Error saving %d last timestamps, retrying with the next points: %s', len(cursors), e)
+                self.unsaved = cursors
+
+
+class ProcessWriterClass:
+    """ The class passes the points encoded in a child process to the writer of the main process, which writes them in
+        influxdb and saves their last timestamps. The queue is shared by all the processes, so they wait when it is
+        full as the poll jobs of a single process do.
+    """
+    def __init__(self, shared_queue):
+        self.queue = shared_queue
+
+    def put(self, db, lines, points, cursors, rp=None):
+        """ The function adds points to the queue of the writer, waiting if it is full
+        :param db: str, the database of the points
+        :param lines: bytes, the points encoded with line protocol
+        :param points: int, the number of points
+        :param cursors: list of tuples, the last timestamps to save once the points are written
+        :param rp: str, the retention policy of the points, None for the default one of the database
+        :return: None
+        """
+        self.queue.put((db, rp, lines, points, cursors))
+
+
+class ParentClass(threading.Thread):
+    """ The class extends the Thread class. When it runs in a child process, it ends the process as soon as the
+        process which started it ends, so that no process keeps downloading without a writer.
+    """
+    def __init__(self, parent):
+        threading.Thread.__init__(self, daemon=True)
+        self.parent = parent
+
+    def run(self):
+        while os.getppid() == self.parent:
+            time.sleep(1)
+        os._exit(1)
+
+
+class ShutdownClass:
+    """ The class stops the script on SIGTERM or SIGINT: no new poll starts, the running ones are completed, and the
+        writer writes the points collected and saves their last timestamps. If the script is not stopped within
+        SHUTDOWN_TIMEOUT seconds from the signal, it exits anyway: the last timestamps are saved only once their points
+        are written, so the points not written are downloaded again at the next start.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.deadline = None
+        self.callbacks = []
+
+    def install(self):
+        """ The function handles the signals stopping the script, also in the processes forked after
+        :return: None
+        """
+        signal.signal(signal.SIGTERM, self.handle)
+        signal.signal(signal.SIGINT, self.handle)
+
+    def handle(self, signum, frame):
+        """ The function handles a signal in a new thread, since the signal can interrupt the main thread while it holds
+            the lock of an event or of the logging
+        :param signum: int
+        :param frame: frame
+        :return: None
+        """
+        threading.Thread(target=self.stop, args=(signal.Signals(signum).name,), daemon=True).start()
+
+    def stop(self, reason):
+        """ The function starts the stop of the script, once
+        :param reason: str
+        :return: None
+        """
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+            self.event.set()
+            callbacks = list(self.callbacks)
+
+        LOG.info('Stopping on %s within %ss', reason, SHUTDOWN_TIMEOUT)
+        for callback in callbacks:
+            callback()
+
+        # The threads which are still blocked do not keep the script running.
+        timer = threading.Timer(SHUTDOWN_TIMEOUT, self.expired)
+        timer.daemon = True
+        timer.start()
+
+    def expired(self):
+        """ The function ends the process when it is not stopped within the deadline
+        :return: None
+        """
+        LOG.error('Not stopped within %ss: exiting, the points not written are downloaded again at the next start',
+                  SHUTDOWN_TIMEOUT)
+        os._exit(1)
+
+    def add(self, callback):
+        """ The function registers a function called when the stop starts, for example to wake up waiting threads
+        :param callback: function without arguments
+        :return: None
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def is_set(self):
+        """ The function tells if the script is stopping
+        :return: bool
+        """
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """ The function waits until the script is stopping, or the timeout passes
+        :param timeout: float, seconds, None to wait forever
+        :return: bool, True if the script is stopping
+        """
+        return self.event.wait(timeout)
+
+    def remaining(self):
+        """ The function returns the seconds left before the deadline of the stop
+        :return: float, None if the script is not stopping
+        """
+        with self.lock:
+            return max(self.deadline - time.monotonic(), 0) if self.deadline is not None else None
+
+
+class SpoolClass(threading.Thread):
+    """ The class extends the Thread class. It appends to files in SPOOL_DIR the points which could not be written in
+        the sink, compressed with gzip, and writes them in the sink when it is available again. A file is closed when
+        it reaches SPOOL_SEGMENT megabytes and it is deleted once all its points are written. Every database has its
+        own files, named with the number of the segment and the database, and the points of the rollups have their
+        own files for every retention policy.
+    """
+    def __init__(self, sink):
+        # The files are deleted only once written, so the replay can be interrupted by the stop of the script.
+        threading.Thread.__init__(self, daemon=True)
+        self.sink = sink
+        self.lock = threading.Lock()
+
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+
+        # The files left by a previous run are replayed as well, the new points go in a new file.
+        segments = self.segments()
+        self.current = (self.parse(segments[-1])[0] + 1) if len(segments) != 0 else 0
+        if len(segments) != 0:
+            LOG.info('Found %d spool files to write', len(segments))
+
+    def segments(self):
+        """ The function lists the files of the spool from the oldest
+        :return: list of str
+        """
+        return sorted(name for name in os.listdir(SPOOL_DIR) if name.endswith('.lp.gz'))
+
+    def parse(self, name):
+        """ The function extracts the segment, the database and the retention policy from the name of a file of the
+            spool
+        :param name: str
+        :return: tuple, the segment, the database and the retention policy, None for the default one
+        """
+        rp = None
+        if name.endswith('.rp.lp.gz'):
+            name, rp = name[:-len('.rp.lp.gz')].rsplit('.', 1)
+            name += '.lp.gz'
+        fields = name[:-len('.lp.gz')].split('.', 1)
+
+        # The files without database are written by the versions saving a single database.
+        return int(fields[0]), fields[1] if len(fields) == 2 else DB, rp
+
+    def path(self, segment, db, rp=None):
+        """ The function returns the path of a file of the spool
+        :param segment: int
+        :param db: str
+        :param rp: str, the retention policy, None for the default one
+        :return: str
+        """
+        if rp is not None:
+            return os.path.join(SPOOL_DIR, '%012d.%s.%s.rp.lp.gz' % (segment, db, rp))
+        return os.path.join(SPOOL_DIR, '%012d.%s.lp.gz' % (segment, db))
+
+    def append(self, db, data, rp=None):
+        """ The function appends points to the current file of the database and waits until they are on disk
+        :param db: str, the database of the points
+        :param data: bytes, the points encoded with line protocol
+        :param rp: str, the retention policy of the points, None for the default one
+        :return: None
+        """
+        block = gzip.compress(data)
+
+        with self.lock:
+            with open(self.path(self.current, db, rp), 'ab') as f:
+                f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+
+            # Close the file when it is big enough.
+            if size >= SPOOL_SEGMENT * 1024 * 1024:
+                self.current += 1
+
+    def run(self):
+        while not SHUTDOWN.wait(5):
+
+            with self.lock:
+                # Close the current files if they have points, so that they can be replayed as well.
+                if any(self.parse(segment)[0] == self.current for segment in self.segments()):
+                    self.current += 1
+                segments = self.segments()
+
+            for segment in segments:
+                if SHUTDOWN.is_set():
+                    break
+                path = os.path.join(SPOOL_DIR, segment)
+                db, rp = self.parse(segment)[1:]
+                lines = self.read(path)
+                written = len(lines)
+
+                try:
+                    for i in range(0, len(lines), BATCH_SIZE):
+                        data = b''.join(lines[i:i + BATCH_SIZE])
+                        try:
+                            self.sink.write(db, data, rp)
+                        except Exception as e:
+                            if self.sink.retryable(e):
+                                raise
+
+                            # The sink refuses the points: they are moved aside instead of being retried forever.
+                            self.quarantine(segment, data)
+                            written -= len(lines[i:i + BATCH_SIZE])
+                            LOG.error('Error writing points from the spool file %s, moved to the quarantine folder: %s',
+                                      segment, e)
+                except Exception:
+                    # The sink is still not available: retry later from the same file.
+                    break
+
+                os.remove(path)
+                LOG.info('Written %d points from the spool file %s', written, segment)
+
+    def read(self, path):
+        """ The function reads the points of a file of the spool. The points of a block left incomplete, for example
+            by a crash while it was appended, are lost, but the ones before it are read.
+        :param path: str
+        :return: list of bytes, the lines of the points
+        """
+        with open(path, 'rb') as f:
+            blocks = f.read()
+
+        data = bytearray()
+
+        # Every block appended to the file is a gzip stream, they are read one after the other.
+        try:
+            while len(blocks) != 0:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += decompressor.decompress(blocks)
+                if not decompressor.eof:
+                    raise EOFError('the last block is incomplete')
+                blocks = decompressor.unused_data
+        except (zlib.error, EOFError) as e:
+            LOG.error('Error reading the spool file %s, the points after the error are lost: %s', path, e)
+
+        lines = bytes(data).splitlines(keepends=True)
+
+        # A line cut by the error is incomplete.
+        if len(lines) != 0 and not lines[-1].endswith(b'\n'):
+            lines.pop()
+
+        return lines
+
+    def quarantine(self, segment, data):
+        """ The function saves in the quarantine folder of the spool points refused by the sink, so that they can be
+            checked and written by hand
+        :param segment: str, the name of the file of the spool
+        :param data: bytes, the points encoded with line protocol
+        :return: None
+        """
+        folder = os.path.join(SPOOL_DIR, 'quarantine')
+        os.makedirs(folder, exist_ok=True)
+
+        with open(os.path.join(folder, segment), 'ab') as f:
+            f.write(gzip.compress(data))
+
+
+class CheckpointClass:
+    """ The class stores the last timestamp of every measurement of every device, and the one of its last reading
+        written, in milliseconds since the epoch, in a SQLite database. The connection stays open for the whole run and
+        the database uses a write-ahead log, so it can be read, for example to export the last timestamps, while the
+        script writes. The last timestamps saved as text by the versions before, in the database or with the shelve
+        module, are converted in milliseconds.
+    """
+    def __init__(self, path, legacy_path):
+        self.lock = threading.Lock()
+        # The instances of the script sharing the database wait for each other instead of failing.
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cursors (device TEXT NOT NULL, measurement TEXT NOT NULL, '
+                                'timestamp INTEGER NOT NULL, written INTEGER, PRIMARY KEY (device, measurement))')
+        self.connection.commit()
+        self.migrate()
+
+        # The shelve file is only read, so it is left for the versions before.
+        self.legacy = {}
+        if dbm.whichdb(legacy_path):
+            try:
+                with shelve.open(legacy_path, flag='r') as legacy:
+                    self.legacy = dict(legacy)
+                LOG.info('Found %d last timestamps saved by the previous version in %s', len(self.legacy),
+                         legacy_path)
+            except Exception as e:
+                LOG.error('Impossible to read the last timestamps saved by the previous version: %s', e)
+
+    def migrate(self):
+        """ The function converts the table of the versions before: the last timestamps saved as text are converted
+            in milliseconds, rebuilding the table with an integer column, and the column of the last readings written
+            is added. The table is converted in one transaction, so another instance starting at the same time waits
+            for it and finds the table already converted.
+        :return: None
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                columns = {row[1]: row[2] for row in self.connection.execute('PRAGMA table_info(cursors)')}
+                if columns['timestamp'] == 'TEXT':
+                    cursors = []
+                    for device, name, timestamp in self.connection.execute('SELECT * FROM cursors').fetchall():
+                        try:
+                            cursors.append((device, name, parse_timestamp(timestamp)))
+                        except ValueError:
+                            LOG.warning('Dropped the invalid last timestamp %r of %s of the device %s', timestamp,
+                                        name, device)
+
+                    self.connection.execute('DROP TABLE cursors')
+                    self.connection.execute('CREATE TABLE cursors (device TEXT NOT NULL, measurement TEXT NOT NULL, '
+                                            'timestamp INTEGER NOT NULL, written INTEGER, '
+                                            'PRIMARY KEY (device, measurement))')
+                    self.connection.executemany('INSERT INTO cursors (device, measurement, timestamp) VALUES (?, ?, ?)',
+                                                cursors)
+                    LOG.info('Converted %d last timestamps in milliseconds', len(cursors))
+                elif 'written' not in columns:
+                    self.connection.execute('ALTER TABLE cursors ADD COLUMN written INTEGER')
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+
+    def set(self, cursors):
+        """ The function saves the last timestamps of some measurements in one transaction
+        :param cursors: list of tuples, the device id, the measurement name, the timestamp and the timestamp of the
+            last reading written in milliseconds, None if it is unknown
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO cursors (device, measurement, timestamp, written) '
+                                        'VALUES (?, ?, ?, ?)', cursors)
+
+    def get(self, device, names, legacy_keys):
+        """ The function gets the last timestamps of the measurements of a device
+        :param device: str, the device id
+        :param names: the names of the measurements
+        :param legacy_keys: dict, the key in the shelve file of every measurement name
+        :return: dict, the timestamp and the timestamp of the last reading written, None if it is unknown, in
+            milliseconds of every measurement saved at least once
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT measurement, timestamp, written FROM cursors WHERE device = ?',
+                                           (device,)).fetchall()
+
+        existing = {}
+        for name, timestamp, written in rows:
+            if name in names:
+                existing[name] = (timestamp, written)
+
+        # Copy in the database the last timestamps saved only in the shelve file.
+        migrated = []
+        for name in names:
+            if name not in existing and legacy_keys[name] in self.legacy:
+                try:
+                    migrated.append((device, name, parse_timestamp(self.legacy[legacy_keys[name]]), None))
+                except ValueError:
+                    LOG.warning('Ignored the invalid last timestamp %r of %s saved by the previous version',
+                                self.legacy[legacy_keys[name]], legacy_keys[name])
+        if len(migrated) != 0:
+            self.set(migrated)
+            for device, name, timestamp, written in migrated:
+                existing[name] = (timestamp, written)
+
+        return existing
+
+    def export(self, path):
+        """ The function writes all the last timestamps in a JSON file
+        :param path: str
+        :return: None
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT device, measurement, timestamp, written FROM cursors').fetchall()
+
+        with open(path, 'w') as f:
+            json.dump([{'device': row[0], 'measurement': row[1], 'timestamp': row[2], 'written': row[3]}
+                       for row in rows], f, indent=2)
+
+    def load(self, path):
+        """ The function saves the last timestamps read from a JSON file written by export(), also by the versions
+            which exported them as text
+        :param path: str
+        :return: None
+        """
+        with open(path) as f:
+            cursors = json.load(f)
+
+        self.set([(cursor['device'], cursor['measurement'], parse_timestamp(cursor['timestamp']),
+                   cursor.get('written')) for cursor in cursors])
+
+
+class BackfillClass:
+    """ The class downloads the history of the measurements from their start timestamp to the time when the script
+        was started. The period is split in windows for every measurement, at most BACKFILL_WORKERS windows are
+        downloaded at the same time and the poll job of a device is scheduled once all its windows are downloaded.
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+        # With the rollups, the windows end at multiples of the longest window of the rollups, so every window of the
+        # rollups is downloaded by a single window of the backfill and aggregated whole.
+        self.align = ROLLUPS[-1][0] if len(ROLLUPS) != 0 else 1
+        self.size = -(-BACKFILL_WINDOW * 1000 // self.align) * self.align
+        self.end = int(time.time() * 1000) // self.align * self.align
+
+        self.windows = collections.deque()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.readings = 0
+        self.started = 0
+        self.reported = 0
+
+    def add(self, raw_class):
+        """ The function splits in windows the history of the measurements of a device
+        :param raw_class: RawClass, the poll job of the device
+        :return: None
+        """
+        self.pending[raw_class] = 0
+
+        for name in raw_class.measurements_names:
+            window_start = raw_class.last_timestamps[name]
+
+            while window_start < self.end:
+                window_end = min(window_start - window_start % self.align + self.size, self.end)
+                self.windows.append(WindowClass(self, raw_class, name, window_start, window_end))
+                self.pending[raw_class] += 1
+                window_start = window_end
+
+        self.total += self.pending[raw_class]
+
+        # Once the history is downloaded, the poll job continues from the end of the backfill.
+        raw_class.last_timestamps = dict.fromkeys(raw_class.measurements_names, self.end)
+
+    def start(self):
+        """ The function schedules the first windows and the poll jobs of the devices without history to download.
+        :return: None
+        """
+        self.started = time.time()
+        LOG.info('Backfill of %d windows until %s started', self.total, format_timestamp(self.end))
+
+        for raw_class in self.pending:
+            if self.pending[raw_class] == 0:
+                self.scheduler.schedule(raw_class, 0)
+
+        with self.lock:
+            windows = [self.windows.popleft() for i in range(min(BACKFILL_WORKERS, len(self.windows)))]
+
+        for window in windows:
+            self.scheduler.schedule(window, 0)
+
+    def window_done(self, window):
+        """ The function schedules the next window when one is downloaded, and the poll job of the device when all its
+            windows are downloaded
+        :param window: WindowClass
+        :return: None
+        """
+        with self.lock:
+            self.done += 1
+            self.readings += window.readings
+            self.pending[window.raw_class] -= 1
+            next_window = self.windows.popleft() if len(self.windows) != 0 else None
+            caught_up = self.pending[window.raw_class] == 0
+            self.report()
+
+        if next_window is not None:
+            self.scheduler.schedule(next_window, 0)
+
+        # Hand off the device to its poll job.
+        if caught_up:
+            LOG.info('Backfill of the device %s completed', window.raw_class.name)
+            self.scheduler.schedule(window.raw_class, 0)
+
+    def report(self):
+        """ The function prints the progress of the backfill at most every ten seconds and when it is completed.
+        :return: None
+        """
+        now = time.time()
+        if now - self.reported < 10 and self.done != self.total:
+            return
+        self.reported = now
+
+        elapsed = now - self.started
+        eta = elapsed * (self.total - self.done) / self.done
+        LOG.info('Backfill: %d/%d windows, %d readings, %d readings/s, ETA %s', self.done, self.total, self.readings,
+                 self.readings / max(elapsed, 1), datetime.timedelta(seconds=int(eta)))
+
+
+class WindowClass:
+    """ The class downloads the readings of a measurement in a time window, one page after the other.
+    """
+    def __init__(self, backfill, raw_class, measurement_name, start, end):
+        self.name = raw_class.name + ' - ' + measurement_name
+        self.backfill = backfill
+        self.raw_class = raw_class
+        self.measurement_name = measurement_name
+        self.start = start
+        self.end = end
+        self.readings = 0
+
+        # The windows have their own limit, BACKFILL_WORKERS, instead of the one of the polls catching up.
+        self.catching_up = False
+
+        # The last timestamp of the readings written: every page starts from the last timestamp of the page before,
+        # which is included, and the readings already written are skipped.
+        self.written = -1
+
+        # The readings already written before, as when the backfill is started again or the stored last timestamp was
+        # moved back, are not written again but only aggregated in the rollups, as by the polls.
+        self.stored = raw_class.written.get(measurement_name, -1)
+        self.buffer = BufferClass(raw_class.writer, raw_class.source['db'], raw_class.tags, raw_class.schema)
+
+    def lag(self):
+        """ The function returns how much the window is behind, from its start to now
+        :return: float, seconds
+        """
+        return time.time() - self.start / 1000
+
+    def request(self):
+        """ The function prepares the request of the next page of the window
+        :return: tuple, the url and the query parameters
+        """
+        # Both the bounds are included, so the window ends a millisecond before the next one starts.
+        return (CLOUD_URL + '/devices/' + self.raw_class.device + '/raw-measurements',
+                {'measurements': self.measurement_name, 'start': format_timestamp(self.start),
+                 'end': format_timestamp(self.end - 1), 'limit': PAGE_LIMIT})
+
+    def process(self, readings):
+        """ The function saves in influxdb a page of readings
+        :param readings: iterable of dict, the readings as received from the cloud
+        :return: 0 if there are more pages to download, None once the window is downloaded
+        """
+        count = 0
+        added = 0
+        duplicates = 0
+        timestamp = None
+        written = self.written
+
+        try:
+            for reading in readings:
+                timestamp = parse_timestamp(reading['timestamp'])
+
+                # The readings already written count as well, since the page is full when they are received, as the
+                # readings which cannot be encoded.
+                count += 1
+                if timestamp <= self.written:
+                    continue
+
+                new = timestamp > self.stored
+                if new:
+                    added += 1
+                else:
+                    duplicates += 1
+                self.buffer.add(reading, timestamp, new)
+                written = timestamp
+
+                if self.buffer.points >= BATCH_SIZE:
+                    self.buffer.flush()
+                    self.written = written
+        except Exception:
+            # The readings encoded by the failed request are dropped, the page is downloaded again.
+            self.buffer.clear()
+            raise
+
+        # The last page closes the windows of the rollups, which are all within the window of the backfill.
+        if count < PAGE_LIMIT and self.buffer.rollup is not None:
+            self.buffer.rollup.close()
+
+        self.buffer.flush()
+        self.written = written
+        self.readings += added
+        if duplicates != 0:
+            METRICS.inc('relayr_duplicate_readings_total', duplicates)
+
+        # A full page means that the server has more readings: the next page starts from the last one received,
+        # included, and only the first reading of the measurement in that millisecond is kept. Only when the whole
+        # page has the same timestamp, the next page starts after it.
+        if count >= PAGE_LIMIT:
+            if timestamp == self.start:
+                LOG.warning('More than %d readings of %s at %s, the ones after the first %d are skipped', PAGE_LIMIT,
+                            self.name, reading['timestamp'], PAGE_LIMIT)
+                timestamp += 1
+            self.start = timestamp
+            return 0
+
+        self.backfill.window_done(self)
+        return None
+
+
+class RingClass:
+    """ The class splits the measurements of the devices among the instances of the script with a consistent hash:
+        every shard has many points on a ring and a measurement belongs to the shard of the first point following its
+        hash. When the number of shards changes, only the measurements between the points added or removed move to
+        another shard.
+    """
+    def __init__(self, shards, points=100):
+        self.points = sorted((ring_hash(str(shard) + '/' + str(point)), shard)
+                             for shard in range(shards) for point in range(points))
+        self.hashes = [point[0] for point in self.points]
+
+    def shard(self, device, name):
+        """ The function returns the shard of a measurement of a device
+        :param device: str, the device id
+        :param name: str, the measurement name
+        :return: int
+        """
+        return self.points[bisect.bisect(self.hashes, ring_hash(device + '/' + name)) % len(self.points)][1]
+
+
+class ReconcilerClass:
+    """ The class keeps the poll jobs in line with the devices to download: every SYNC_INTERVAL seconds it requests
+        the list of the devices, creates the jobs of the new devices, stops the jobs of the removed ones and changes the
+        measurements of the devices whose model changed, without touching the other jobs.
+    """
+    def __init__(self, writer, checkpoint, metadata, scheduler):
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.metadata = metadata
+        self.scheduler = scheduler
+        self.raw_classes = {}
+        self.model_keys = {}
+        self.schemas = {}
+
+    def run(self, delay):
+        """ The function updates the jobs every SYNC_INTERVAL seconds until the script is stopping, it runs in the main
+            thread once the jobs are started
+        :param delay: float, seconds before the first update
+        :return: None
+        """
+        while not SHUTDOWN.wait(delay):
+            delay = SYNC_INTERVAL
+            try:
+                devices = get_devices(self.metadata)
+                self.reconcile(devices, self.metadata.get(list(devices)))
+            except Exception as e:
+                LOG.error('Error updating the devices to download: %s', e)
+
+    async def async_run(self, engine, delay):
+        """ The function does the same as run() with the asyncio engine
+        :param engine: AsyncEngineClass
+        :param delay: float, seconds before the first update
+        :return: None
+        """
+        while not await engine.sleep(delay):
+            delay = SYNC_INTERVAL
+            try:
+                devices = await async_get_devices(engine, self.metadata)
+                self.reconcile(devices, await self.metadata.async_get(engine, list(devices)))
+            except Exception as e:
+                LOG.error('Error updating the devices to download: %s', e)
+
+    def lags(self):
+        """ The function returns how much the download of every measurement is behind, from its last timestamp to now
+        :return: list of tuples, the labels and the lag in seconds of every measurement
+        """
+        now = time.time()
+        lags = []
+
+        for raw_class in list(self.raw_classes.values()):
+            for name, timestamp in list(raw_class.last_timestamps.items()):
+                lags.append(((('device', raw_class.device), ('measurement', name)),
+                             now - timestamp / 1000))
+        return lags
+
+    def reconcile(self, devices, infos):
+        """ The function compares the devices to download with the ones of the running jobs and updates the jobs
+        :param devices: dict, the source of every device to download
+        :param infos: list of tuples, the device info and the model info of the devices whose info are available
+        :return: None
+        """
+        raw_class_list = []
+
+        for device_req_json, model_req_json in infos:
+            device = device_req_json['id']
+
+            # The devices already known are checked again only when their model or version changes.
+            if self.model_keys.get(device) == model_key(device_req_json):
+                continue
+            if device in self.model_keys:
+                LOG.info('The model of the device %s changed', device_req_json['name'])
+            self.model_keys[device] = model_key(device_req_json)
+
+            source = devices[device]
+            measurements_names = get_measurements_names(model_req_json, source['special_char'], device)
+
+            # The devices of the same model share its encoders.
+            key = model_key(device_req_json)
+            if key not in self.schemas:
+                self.schemas[key] = SchemaClass(model_req_json)
+            schema = self.schemas[key]
+
+            # Change the measurements of a device whose model or version changed, or stop its job if no measurement
+            # is left to download.
+            if device in self.raw_classes:
+                if len(measurements_names) != 0:
+                    self.raw_classes[device].change(measurements_names, schema)
+                else:
+                    self.raw_classes.pop(device).stop()
+
+            # Create the job of a new device.
+            elif len(measurements_names) != 0:
+                self.raw_classes[device] = create_raw_class(self.writer, self.checkpoint, source, device_req_json,
+                                                            measurements_names, schema)
+                raw_class_list.append(self.raw_classes[device])
+
+            else:
+                LOG.info('No measurements to download for device %s (%s)', device_req_json['name'], device)
+
+        # Stop the jobs of the removed devices.
+        for device in list(self.model_keys):
+            if device not in devices:
+                self.model_keys.pop(device)
+                if device in self.raw_classes:
+                    LOG.info('Stopping the download of the device %s', self.raw_classes[device].name)
+                    self.raw_classes.pop(device).stop()
+
+        if len(raw_class_list) != 0:
+            schedule_raw_classes(self.scheduler, raw_class_list)
+
+
+class MetadataClass:
+    """ The class caches the devices of the groups and the info of the devices and of their models, so that the devices
+        sharing a model request it only once, and saves them in a JSON file to be available at the next start. The
+        info older than METADATA_TTL seconds are requested again, while the devices of the groups are requested at
+        every update of the jobs and read from the cache only at the start. Only the info with the fields used by the
+        script are cached.
+    """
+    # The fields which must be in the info of a group, of a device and of a model.
+    GROUP_FIELDS = ('devices',)
+    DEVICE_FIELDS = ('id', 'name', 'modelId', 'modelVersion')
+    MODEL_FIELDS = ('measurements',)
+
+    def __init__(self):
+        self.path = str(DB) + '.metadata.json'
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.devices = {}
+        self.models = {}
+
+        # Whether expired info were used at the start, so they are requested again as soon as the jobs are started.
+        self.stale = False
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    cache = json.load(f)
+                # The caches of the versions before have no groups.
+                self.groups = {key: entry for key, entry in cache.get('groups', {}).items()
+                               if self.valid(entry['info'], self.GROUP_FIELDS)}
+                self.devices = {key: entry for key, entry in cache['devices'].items()
+                                if self.valid(entry['info'], self.DEVICE_FIELDS)}
+                self.models = {key: entry for key, entry in cache['models'].items()
+                               if self.valid(entry['info'], self.MODEL_FIELDS)}
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                LOG.error('Impossible to read the metadata cache: %s', e)
+
+    def get(self, devices, cached=False):
+        """ The function gets the info of some devices and of their models, requesting concurrently the expired ones
+        :param devices: list of str, the device ids
+        :param cached: bool, True to use also the expired info, requesting only the ones not cached
+        :return: list of tuples, the device info and the model info of every device whose info are available
+        """
+        with concurrent.futures.ThreadPoolExecutor(WORKERS) as executor:
+            missing = self.expired(self.devices, devices, cached)
+            self.store(self.devices, missing, executor.map(self.fetch, [device_url(key) for key in missing]),
+                       self.DEVICE_FIELDS)
+
+            missing = self.expired(self.models, self.model_keys(devices), cached)
+            self.store(self.models, missing, executor.map(self.fetch, [model_url(key) for key in missing]),
+                       self.MODEL_FIELDS)
+
+        return self.infos(devices)
+
+    async def async_get(self, engine, devices, cached=False):
+        """ The function does the same as get() with the asyncio engine
+        :param engine: AsyncEngineClass
+        :param devices: list of str, the device ids
+        :param cached: bool, True to use also the expired info, requesting only the ones not cached
+        :return: list of tuples, the device info and the model info of every device whose info are available
+        """
+        missing = self.expired(self.devices, devices, cached)
+        self.store(self.devices, missing,
+                   await asyncio.gather(*[self.async_fetch(engine, device_url(key)) for key in missing]),
+                   self.DEVICE_FIELDS)
+
+        missing = self.expired(self.models, self.model_keys(devices), cached)
+        self.store(self.models, missing,
+                   await asyncio.gather(*[self.async_fetch(engine, model_url(key)) for key in missing]),
+                   self.MODEL_FIELDS)
+
+        return self.infos(devices)
+
+    def fetch(self, url):
+        """ The function requests an info to the cloud
+        :param url: str
+        :return: the parsed JSON, None if the request failed
+        """
+        try:
+            return get_json(url)
+        except Exception as e:
+            LOG.error('Error requesting %s: %s', url, e)
+            return None
+
+    async def async_fetch(self, engine, url):
+        """ The function does the same as fetch() with the asyncio engine
+        :param engine: AsyncEngineClass
+        :param url: str
+        :return: the parsed JSON, None if the request failed
+        """
+        try:
+            return await engine.get_json(url)
+        except Exception as e:
+            LOG.error('Error requesting %s: %s', url, e)
+            return None
+
+    def expired(self, entries, keys, cached=False):
+        """ The function finds the info not cached or older than METADATA_TTL seconds
+        :param entries: dict, the cached info
+        :param keys: list of str
+        :param cached: bool, True to find only the info not cached, noting if some are expired
+        :return: list of str, without duplicates
+        """
+        now = time.time()
+        expired = [key for key in dict.fromkeys(keys)
+                   if key not in entries or now - entries[key]['time'] > METADATA_TTL]
+        if not cached:
+            return expired
+
+        if any(key in entries for key in expired):
+            self.stale = True
+        return [key for key in expired if key not in entries]
+
+    def missing_groups(self, cached=False):
+        """ The function finds the groups whose devices must be requested
+        :param cached: bool, True to find only the groups not cached, noting if some are cached
+        :return: list of str, without duplicates
+        """
+        groups = list(dict.fromkeys(source['id'] for source in SOURCES if source['kind'] == 'group'))
+        if not cached:
+            return groups
+
+        if any(group in self.groups for group in groups):
+            self.stale = True
+        return [group for group in groups if group not in self.groups]
+
+    def store_groups(self, groups, infos):
+        """ The function caches the devices of the groups received, only their ids
+        :param groups: list of str
+        :param infos: list, the info of the groups received in the same order
+        :return: None
+        """
+        self.store(self.groups, groups, [{'devices': [{'id': dic['id']} for dic in info['devices']]}
+                                         if self.valid(info, self.GROUP_FIELDS) else info for info in infos],
+                   self.GROUP_FIELDS)
+
+    def sources(self):
+        """ The function lists the devices to download, the single devices and the cached devices of the groups
+        :return: dict, the source of every device id
+        """
+        devices = {}
+
+        for source in SOURCES:
+            if source['kind'] == 'device':
+                devices.setdefault(source['id'], source)
+                continue
+
+            # Extract the devices IDs from the JSON.
+            for dic in self.groups[source['id']]['info']['devices']:
+                devices.setdefault(dic['id'], source)
+
+        return devices
+
+    def model_keys(self, devices):
+        """ The function returns the keys of the models of the devices with cached info
+        :param devices: list of str, the device ids
+        :return: list of str
+        """
+        return [model_key(self.devices[device]['info']) for device in devices if device in self.devices]
+
+    def valid(self, info, fields):
+        """ The function checks that an info received contains the fields used by the script
+        :param info: the parsed JSON
+        :param fields: tuple of str
+        :return: bool
+        """
+        return isinstance(info, dict) and all(field in info for field in fields)
+
+    def store(self, entries, keys, infos, fields):
+        """ The function caches the info received and saves the cache in the JSON file. The info whose request failed
+            or without the needed fields are not changed, so the expired ones are still used.
+        :param entries: dict, the cached info
+        :param keys: list of str
+        :param infos: list, the info received in the same order of the keys
+        :param fields: tuple of str, the fields which must be in the info
+        :return: None
+        """
+        now = time.time()
+        stored = 0
+
+        with self.lock:
+            for key, info in zip(keys, infos):
+                if info is None:
+                    continue
+                if not self.valid(info, fields):
+                    LOG.warning('The info received for %s are not valid: %.200s', key, info)
+                    continue
+                entries[key] = {'time': now, 'info': info}
+                stored += 1
+
+            if stored != 0:
+                # Write a new file and replace the old one, so it is never left half written, also when more instances
+                # of the script share the file.
+                temp = self.path + '.' + str(os.getpid()) + '.tmp'
+                with open(temp, 'w') as f:
+                    json.dump({'groups': self.groups, 'devices': self.devices, 'models': self.models}, f)
+                os.replace(temp, self.path)
+
+    def infos(self, devices):
+        """ The function returns the cached info of some devices and of their models
+        :param devices: list of str, the device ids
+        :return: list of tuples, the device info and the model info of every device whose info are available
+        """
+        infos = []
+
+        for device in devices:
+            if device not in self.devices or model_key(self.devices[device]['info']) not in self.models:
+                LOG.warning('The info of the device %s are not available', device)
+                continue
+            infos.append((self.devices[device]['info'], self.models[model_key(self.devices[device]['info'])]['info']))
+
+        return infos
+
+
+class RateFilterClass(logging.Filter):
+    """ The class extends the Filter class of logging. It lets through at most LOG_BURST warnings and errors with the
+        same message every LOG_INTERVAL seconds, so that a failure repeated by many jobs does not flood the log. The
+        number of messages dropped is logged with the next one.
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.lock = threading.Lock()
+
+        # The start of the interval, the messages logged and the messages dropped for every message.
+        self.intervals = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        # The messages are counted by their text before the number of messages dropped is added.
+        msg = record.msg
+        now = time.monotonic()
+        with self.lock:
+            interval = self.intervals.get(msg)
+            if interval is None or now - interval[0] >= LOG_INTERVAL:
+                if interval is not None and interval[2] != 0:
+                    record.msg = msg + ' (' + str(interval[2]) + ' similar messages dropped)'
+                interval = [now, 0, 0]
+                self.intervals[msg] = interval
+
+            interval[1] += 1
+            if interval[1] > LOG_BURST:
+                interval[2] += 1
+                return False
+        return True
+
+
+class MetricsClass:
+    """ The class collects the metrics of the process and formats them in the text format of Prometheus. The counters
+        and the histograms are updated by the jobs, while the gauges are read from the objects of the script when the
+        metrics are requested.
+    """
+    # The upper bounds of the buckets of the histograms of durations, in seconds, and of sizes, in points.
+    TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    SIZE_BUCKETS = (1, 10, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1, labels=()):
+        """ The function increases a counter
+        :param name: str
+        :param value: float
+        :param labels: tuple of tuples, the name and the value of every label
+        :return: None
+        """
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS):
+        """ The function adds a value to a histogram
+        :param name: str
+        :param value: float
+        :param buckets: tuple of float, the upper bounds of the buckets
+        :return: None
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [buckets, [0] * len(buckets), 0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def gauge(self, name, function):
+        """ The function registers a gauge, whose values are read when the metrics are requested
+        :param name: str
+        :param function: function returning a number, or a list of tuples with the labels and the value
+        :return: None
+        """
+        with self.lock:
+            self.gauges[name] = function
+
+    def labels(self, labels):
+        """ The function formats the labels of a metric
+        :param labels: tuple of tuples, the name and the value of every label
+        :return: str
+        """
+        if len(labels) == 0:
+            return ''
+        formatted = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            formatted.append(key + '="' + value + '"')
+        return '{' + ','.join(formatted) + '}'
+
+    def render(self):
+        """ The function formats all the metrics
+        :return: str
+        """
+        lines = []
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = [(name, histogram[0], list(histogram[1]), histogram[2], histogram[3])
+                          for name, histogram in sorted(self.histograms.items())]
+            gauges = sorted(self.gauges.items())
+
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                lines.append('# TYPE ' + name + ' counter')
+                previous = name
+            lines.append(name + self.labels(labels) + ' ' + repr(value))
+
+        for name, buckets, counts, total, count in histograms:
+            lines.append('# TYPE ' + name + ' histogram')
+            for bucket, cumulative in zip(buckets, itertools.accumulate(counts)):
+                lines.append(name + '_bucket{le="' + repr(bucket) + '"} ' + str(cumulative))
+            lines.append(name + '_bucket{le="+Inf"} ' + str(count))
+            lines.append(name + '_sum ' + repr(total))
+            lines.append(name + '_count ' + str(count))
+
+        for name, function in gauges:
+            try:
+                values = function()
+            except Exception as e:
+                LOG.error('Error reading the metric %s: %s', name, e)
+                continue
+            lines.append('# TYPE ' + name + ' gauge')
+            if not isinstance(values, list):
+                values = [((), values)]
+            for labels, value in values:
+                lines.append(name + self.labels(labels) + ' ' + repr(float(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandlerClass(http.server.BaseHTTPRequestHandler):
+    """ The class extends the BaseHTTPRequestHandler class. It answers to the requests of the metrics.
+    """
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The requests are not logged.
+        pass
+
+
+class MetricsServerClass(threading.Thread):
+    """ The class extends the Thread class. It serves the metrics of the process over HTTP at /metrics.
+    """
+    def __init__(self, port):
+        threading.Thread.__init__(self, daemon=True)
+        self.server = http.server.ThreadingHTTPServer(('', port), MetricsHandlerClass)
+        self.server.daemon_threads = True
+        LOG.info('Serving the metrics on port %d', port)
+
+    def run(self):
+        self.server.serve_forever()
+
+
+class AsyncEngineClass:
+    """ The class runs the polls of all the measurements as tasks of one asyncio event loop. All
+        the requests share one aiohttp session, which keeps alive at most CONCURRENCY connections to the cloud.
+    """
+    def __init__(self):
+        if aiohttp is None:
+            raise RuntimeError('The asyncio engine requires the aiohttp module: pip install aiohttp')
+
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONCURRENCY, keepalive_timeout=60),
+                                             timeout=aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT,
+                                                                           sock_read=REQUEST_TIMEOUT))
+        self.loop = asyncio.get_running_loop()
+        self.tasks = set()
+
+        # The jobs catching up wait for each other, so at most CATCHUP_WORKERS of them poll at the same time.
+        self.catchup = asyncio.Semaphore(CATCHUP_WORKERS)
+
+        # The event wakes up the jobs waiting for their next poll when the script is stopping.
+        self.stopping = asyncio.Event()
+        SHUTDOWN.add(self.stop)
+
+    def stop(self):
+        """ The function wakes up the jobs waiting for their next poll, unless the event loop already ended after an
+            error
+        :return: None
+        """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def spawn(self, coroutine):
+        """ The function runs a coroutine as a task, keeping a reference to it until it is done
+        :param coroutine: coroutine
+        :return: asyncio.Task
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def schedule(self, job, delay):
+        """ The function starts polling a job after the given delay. It can be called also by the threads running
+            process(), so the task is created by the event loop.
+        :param job: object with the request() and process() methods
+        :param delay: float, seconds
+        :return: None
+        """
+        self.loop.call_soon_threadsafe(self.spawn, self.run_job(job, delay))
+
+    async def sleep(self, delay):
+        """ The function waits for the given delay, or until the script is stopping
+        :param delay: float, seconds
+        :return: bool, True if the script is stopping
+        """
+        try:
+            await asyncio.wait_for(self.stopping.wait(), delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run_forever(self):
+        """ The function waits until the script is stopping, then until the running polls are completed.
+        :return: None
+        """
+        await self.stopping.wait()
+
+        # The polls not completed within the deadline are cancelled, their readings are downloaded again at the next
+        # start.
+        if len(self.tasks) != 0:
+            done, pending = await asyncio.wait(list(self.tasks), timeout=SHUTDOWN.remaining())
+            for task in pending:
+                task.cancel()
+
+    async def get(self, url, params=None):
+        """ The function does the same as cloud_get() with the session of the engine
+        :param url: str
+        :param params: dict, query parameters
+        :return: aiohttp.ClientResponse, with a successful status
+        """
+        endpoint = LIMITER.endpoint(url)
+        attempt = 1
+
+        while True:
+            token = await AUTH.async_get()
+            await asyncio.sleep(LIMITER.acquire(endpoint))
+
+            try:
+                resp = await self.session.get(url, params=params, headers={'authorization': 'Bearer ' + token})
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                LIMITER.answered(endpoint, None, None)
+                raise
+            LIMITER.answered(endpoint, resp.status, resp.headers.get('Retry-After'))
+
+            # A rejected token is replaced and the request is sent again once, with the new token.
+            if resp.status == 401:
+                AUTH.rejected(token)
+                if attempt == 1:
+                    resp.release()
+                    attempt += 1
+                    continue
+
+            # An answer with an error status does not contain the requested JSON, it is released by
+            # raise_for_status().
+            resp.raise_for_status()
+            return resp
+
+    async def post_json(self, url, **kwargs):
+        """ The function sends a POST request to the login service with the session of the engine
+        :param url: str
+        :return: the parsed JSON received as answer
+        """
+        async with self.session.post(url, **kwargs) as resp:
+            # An answer with an error status does not contain the requested JSON.
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+    async def get_json(self, url, params=None):
+        """ The function does the same as get_json() with the session of the engine
+        :param url: str
+        :param params: dict, query parameters
+        :return: the parsed JSON received as answer
+        """
+        attempt = 1
+        while True:
+            try:
+                async with await self.get(url, params) as resp:
+                    return await resp.json(content_type=None)
+            except Exception as e:
+                if attempt == REQUEST_RETRIES or not is_transient(e):
+                    raise
+                attempt += 1
+                await asyncio.sleep(LIMITER.remaining(LIMITER.endpoint(url)))
+
+    def iter_chunks(self, stream):
+        """ The function reads from a thread outside the event loop the chunks of an answer received by the event loop
+        :param stream: aiohttp.StreamReader
+        :return: generator of bytes
+        """
+        while True:
+            chunk = asyncio.run_coroutine_threadsafe(stream.read(CHUNK_SIZE), self.loop).result()
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    async def run_job(self, job, delay):
+        """ The function polls a job forever, waiting between the polls the delay returned by the job
+        :param job: object with the request() and process() methods
+        :param delay: float, seconds to wait before the first poll
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+
+        # A job returning None does not need to run again, and no job runs again once the script is stopping.
+        while delay is not None:
+            if await self.sleep(delay):
+                return
+            catching_up = job.catching_up
+            if catching_up:
+                await self.catchup.acquire()
+            started = time.monotonic()
+            try:
+                request = job.request()
+
+                # A stopped job does not run again.
+                if request is None:
+                    return
+                url, params = request
+                async with await self.get(url, params) as raw_req:
+
+                    # Parsing and encoding the readings blocks, so it runs in a thread of the default executor, which
+                    # reads the answer from the event loop while it is received.
+                    delay = await loop.run_in_executor(None, job.process,
+                                                       iter_readings(self.iter_chunks(raw_req.content)))
+                METRICS.observe('relayr_poll_duration_seconds', time.monotonic() - started)
+            except BlockedError as e:
+                # The job tries again once the requests can be sent.
+                delay = e.delay
+            except Exception as e:
+                LOG.error('Error polling %s: %s', job.name, e)
+                METRICS.inc('relayr_poll_errors_total')
+                delay = REFRESH
+            finally:
+                if catching_up:
+                    self.catchup.release()
+
+
+#######################################################################################################################
+#   Parsing Command Line Args                                                                                         #
+#######################################################################################################################
+def parse_args(kind):
+    """ The function parse the args specified in the CLI.
+    :param kind: str, 'group' or 'device', the option identifying what to download
+    :return: parsed args
+    """
+    parser = argparse.ArgumentParser(description="MQTT to InfluxDB")
+    parser.add_argument('--db', type=str, required=True,
+                        help="Name of InfluxDB database where save the data.")
+    if kind == 'group':
+        parser.add_argument('--group', type=str, required=False, default=None,
+                            help="The ID of the group to download the measurements.")
+    else:
+        parser.add_argument('--device', type=str, required=False, default=None,
+                            help="The deviceID of the device to download the measurements.")
+    parser.add_argument('--config', type=str, required=False, default=None,
+                        help="YAML or JSON file listing the groups and the devices to download, instead of the " +
+                             kind + ".")
+    parser.add_argument('--cloud_url', type=str, required=False, default='https://cloud.relayr.io',
+                        help="Base URL of the API of relayr cloud.")
+    parser.add_argument('--login_url', type=str, required=False, default='https://login.relayr.io',
+                        help="Base URL of the login service of relayr cloud.")
+    parser.add_argument('--user', type=str, required=True,
+                        help="The user in relayr cloud.")
+    parser.add_argument('--password', type=str, required=True,
+                        help="The password in relayr cloud.")
+    parser.add_argument('--org', type=str, required=True,
+                        help="The organization in relayr cloud.")
+    parser.add_argument('--start', type=str, required=False, default=None,
+                        help="The starting time from when download data.")
+    parser.add_argument('--influxdb_address', type=str, required=False, default="localhost",
+                        help="The address where is hosted the local instance of InfluxDB.")
+    parser.add_argument('--influxdb_port', type=int, required=False, default=8086,
+                        help="The port where is running the local instance of InfluxDB.")
+    parser.add_argument('--special_char', type=str, required=False, default=None,
+                        help="The char in measurement name used to filter the selection.")
+    parser.add_argument('--refresh', type=int, required=False, default=10,
+                        help="Seconds to wait before downloading again new raw data.")
+    parser.add_argument('--min_refresh', type=float, required=False, default=None,
+                        help="Minimum seconds between the downloads of a measurement, by default the refresh.")
+    parser.add_argument('--max_refresh', type=float, required=False, default=None,
+                        help="Maximum seconds between the downloads of a measurement, by default the refresh.")
+    parser.add_argument('--jitter', type=float, required=False, default=0.1,
+                        help="Fraction of the interval by which the downloads are randomly anticipated or delayed.")
+    parser.add_argument('--workers', type=int, required=False, default=10,
+                        help="Number of worker threads downloading the raw data.")
+    parser.add_argument('--engine', type=str, required=False, default='threads', choices=['threads', 'asyncio'],
+                        help="Run the downloads on the pool of worker threads or on one asyncio event loop.")
+    parser.add_argument('--concurrency', type=int, required=False, default=10,
+                        help="Maximum number of connections to the cloud opened by the asyncio engine.")
+    parser.add_argument('--backfill', action='store_true',
+                        help="Download the history from the starting time in parallel windows before polling.")
+    parser.add_argument('--backfill_window', type=int, required=False, default=3600,
+                        help="Seconds of history downloaded by every window of the backfill.")
+    parser.add_argument('--backfill_workers', type=int, required=False, default=4,
+                        help="Maximum number of windows of the backfill downloaded at the same time.")
+    parser.add_argument('--page_limit', type=int, required=False, default=1000,
+                        help="Maximum number of readings requested to the cloud with one request.")
+    parser.add_argument('--catchup_workers', type=int, required=False, default=4,
+                        help="Maximum number of polls of the measurements catching up sent at the same time.")
+    parser.add_argument('--metadata_ttl', type=int, required=False, default=3600,
+                        help="Seconds after which the cached info of the devices and models are requested again.")
+    parser.add_argument('--sync_interval', type=int, required=False, default=300,
+                        help="Seconds between the checks of the devices to download and of their models.")
+    parser.add_argument('--shards', type=int, required=False, default=1,
+                        help="Number of instances of the script sharing the measurements of the devices.")
+    parser.add_argument('--shard', type=int, required=False, default=0,
+                        help="Index from 0 of the shard of the measurements downloaded by this instance.")
+    parser.add_argument('--processes', type=int, required=False, default=1,
+                        help="Number of processes downloading the measurements, each one with its part of the shard.")
+    parser.add_argument('--rate_limit', type=float, required=False, default=0,
+                        help="Maximum requests per second sent to the cloud by this instance, 0 for no limit.")
+    parser.add_argument('--rate_burst', type=int, required=False, default=10,
+                        help="Maximum requests sent at once to the cloud when the rate limit is not reached.")
+    parser.add_argument('--breaker_failures', type=int, required=False, default=5,
+                        help="Consecutive failures of an endpoint of the cloud after which its requests are paused.")
+    parser.add_argument('--breaker_time', type=int, required=False, default=60,
+                        help="Seconds for which the requests to a failing endpoint are paused.")
+    parser.add_argument('--metrics_port', type=int, required=False, default=None,
+                        help="Port where the metrics are served at /metrics, by default they are not served.")
+    parser.add_argument('--log_level', type=str, required=False, default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Minimum level of the messages logged, DEBUG logs every reading.")
+    parser.add_argument('--export_cursors', type=str, required=False, default=None,
+                        help="Write the stored last timestamps in this JSON file and exit.")
+    parser.add_argument('--import_cursors', type=str, required=False, default=None,
+                        help="Store the last timestamps read from this JSON file before starting.")
+    parser.add_argument('--batch_size', type=int, required=False, default=5000,
+                        help="Number of points collected before writing them in InfluxDB.")
+    parser.add_argument('--batch_time', type=int, required=False, default=1000,
+                        help="Milliseconds after which the collected points are written in InfluxDB.")
+    parser.add_argument('--field_types', type=str, required=False, default='model', choices=['model', 'float'],
+                        help="Encode the values with the types of the measurements in the models, or all as floats.")
+    parser.add_argument('--rollups', type=str, required=False, default=None,
+                        help="Comma separated windows of the rollups written besides the readings, each with the "
+                             "duration of its retention policy, e.g. 1m:30d,1h:inf.")
+    parser.add_argument('--rollups_only', action='store_true',
+                        help="Write only the rollups, not the readings.")
+    parser.add_argument('--sink', type=str, required=False, default='influxdb',
+                        choices=['influxdb', 'influxdb_gzip', 'udp', 'parquet', 'csv', 'sqlite'],
+                        help="Where the points are written: InfluxDB over HTTP, also compressed with gzip, or over "
+                             "UDP, or local Parquet, CSV or SQLite files.")
+    parser.add_argument('--sink_path', type=str, required=False, default=None,
+                        help="Folder of the Parquet and CSV files, or SQLite file, by default DB.points.")
+    parser.add_argument('--sink_rotate', type=int, required=False, default=3600,
+                        help="Seconds after which the Parquet and CSV files are written in a new folder or file.")
+    parser.add_argument('--udp_port', type=int, required=False, default=8089,
+                        help="Port of the UDP listener of InfluxDB for the udp sink.")
+    parser.add_argument('--shutdown_timeout', type=float, required=False, default=30,
+                        help="Seconds given on SIGTERM to complete the running polls and write their points.")
+    parser.add_argument('--queue_size', type=int, required=False, default=100,
+                        help="Number of downloads waiting to be written before the downloads are paused.")
+    parser.add_argument('--spool_dir', type=str, required=False, default=None,
+                        help="Folder where the points not written in InfluxDB are saved, by default DB.spool.")
+    parser.add_argument('--spool_segment', type=int, required=False, default=16,
+                        help="Size in megabytes of the files of the spool.")
+    args = parser.parse_args()
+
+    if getattr(args, kind) is None and args.config is None:
+        parser.error('the ' + kind + ' or the config file is required')
+    if not 0 <= args.shard < args.shards:
+        parser.error('the shard must be between 0 and the number of shards - 1')
+
+    try:
+        args.rollups = parse_rollups(args.rollups) if args.rollups is not None else []
+    except ValueError as e:
+        parser.error(str(e))
+    if args.rollups_only and len(args.rollups) == 0:
+        parser.error('the rollups are required to write only the rollups')
+    if args.sink == 'udp' and len(args.rollups) != 0:
+        parser.error('the rollups need their retention policies, which cannot be chosen with the udp sink')
+    if args.sink_rotate <= 0:
+        parser.error('the seconds of the rotation of the sink files must be positive')
+    if args.catchup_workers < 1:
+        parser.error('at least a poll catching up must be allowed')
+
+    return args
+
+
+#######################################################################################################################
+#   Run                                                                                                               #
+#######################################################################################################################
+def run(kind):
+    """ The function assigns the parameters passed via command line to the global variables and starts the download.
+        It is called by the scripts downloading a group and a device.
+    :param kind: str, 'group' or 'device'
+    :return: None
+    """
+    global DB, USER, PASSWORD, ORG, START, INFLUXDB_ADDRESS, INFLUXDB_PORT, SPECIAL_CHAR, REFRESH, MIN_REFRESH
+    global MAX_REFRESH, JITTER, WORKERS, ENGINE, CONCURRENCY, BACKFILL, BACKFILL_WINDOW, BACKFILL_WORKERS, PAGE_LIMIT
+    global METADATA_TTL, SYNC_INTERVAL, EXPORT_CURSORS, IMPORT_CURSORS, BATCH_SIZE, BATCH_TIME, QUEUE_SIZE, SHARDS
+    global SHARD, PROCESSES, SPOOL_DIR, SPOOL_SEGMENT, SOURCES, RING, RESUME, RATE_LIMIT, RATE_BURST, BREAKER_FAILURES
+    global BREAKER_TIME, LIMITER, METRICS_PORT, METRICS, CLOUD_URL, LOGIN_URL, FIELD_TYPES, ROLLUPS, ROLLUPS_ONLY
+    global SINK, SINK_PATH, SINK_ROTATE, UDP_PORT, SHUTDOWN_TIMEOUT, SHUTDOWN, CATCHUP_WORKERS
+
+    # Assign passed parameters to global variables.
+    args = parse_args(kind)
+
+    # Log the messages with their time and level, limiting the repeated warnings and errors.
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=args.log_level)
+    LOG.addFilter(RateFilterClass())
+    DB = args.db
+    CLOUD_URL = args.cloud_url.rstrip('/')
+    LOGIN_URL = args.login_url.rstrip('/')
+    USER = args.user
+    PASSWORD = args.password
+    ORG = args.org
+    START = args.start
+    INFLUXDB_ADDRESS = args.influxdb_address
+    INFLUXDB_PORT = args.influxdb_port
+    SPECIAL_CHAR = args.special_char
+    REFRESH = args.refresh
+    MIN_REFRESH = args.min_refresh
+    MAX_REFRESH = args.max_refresh
+    JITTER = args.jitter
+    WORKERS = args.workers
+    ENGINE = args.engine
+    CONCURRENCY = args.concurrency
+    BACKFILL = args.backfill
+    BACKFILL_WINDOW = args.backfill_window
+    BACKFILL_WORKERS = args.backfill_workers
+    PAGE_LIMIT = args.page_limit
+    CATCHUP_WORKERS = args.catchup_workers
+    METADATA_TTL = args.metadata_ttl
+    SYNC_INTERVAL = args.sync_interval
+    EXPORT_CURSORS = args.export_cursors
+    IMPORT_CURSORS = args.import_cursors
+    BATCH_SIZE = args.batch_size
+    BATCH_TIME = args.batch_time
+    FIELD_TYPES = args.field_types
+    ROLLUPS = args.rollups
+    ROLLUPS_ONLY = args.rollups_only
+    QUEUE_SIZE = args.queue_size
+    SHARDS = args.shards
+    SHARD = args.shard
+    PROCESSES = args.processes
+    SPOOL_DIR = args.spool_dir if args.spool_dir is not None else DB + '.spool'
+    SPOOL_SEGMENT = args.spool_segment
+    RATE_LIMIT = args.rate_limit
+    RATE_BURST = args.rate_burst
+    BREAKER_FAILURES = args.breaker_failures
+    BREAKER_TIME = args.breaker_time
+    METRICS_PORT = args.metrics_port
+    SINK = args.sink
+    SINK_PATH = args.sink_path
+    if SINK_PATH is None:
+        SINK_PATH = DB + '.points.sqlite' if SINK == 'sqlite' else DB + '.points'
+    SINK_ROTATE = args.sink_rotate
+    UDP_PORT = args.udp_port
+    SHUTDOWN_TIMEOUT = args.shutdown_timeout
+
+    # The metrics are collected also when they are not served, since it costs little.
+    METRICS = MetricsClass()
+
+    # All the requests to the cloud pass through the limiter.
+    LIMITER = LimiterClass()
+
+    # The stop of the script on SIGTERM and SIGINT.
+    SHUTDOWN = ShutdownClass()
+
+    # The groups and the devices to download, with their own database, filter and refresh.
+    if args.config is not None:
+        SOURCES = load_config(args.config)
+    else:
+        SOURCES = [make_source(kind, {'id': getattr(args, kind)}, kind == 'group')]
+
+    # With more shards every instance downloads only its measurements and saves the points it cannot write in its own
+    # spool, while the last timestamps are shared, so the measurements moving to another shard continue from there.
+    if SHARDS > 1:
+        RING = RingClass(SHARDS)
+        if args.spool_dir is None:
+            SPOOL_DIR = DB + '.spool.' + str(SHARD)
+
+    # Control if the passed starting date is in the requested format.
+    if START is not None:
+
+        # If the date passed is not valid, setting up the default start: one hour before the script starting.
+        if not validate_isodate(START):
+            START = (datetime.datetime.utcnow() - datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    else:
+        START = (datetime.datetime.utcnow() - datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        # Without a starting date the download continues from the stored last timestamps.
+        RESUME = True
+
+    # The timestamps are handled in milliseconds since the epoch, they are formatted only in the requests to the cloud.
+    START = parse_timestamp(START)
+
+    main()